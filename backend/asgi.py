@@ -0,0 +1,170 @@
+"""
+Production entry point
+    uvicorn asgi:app --host 0.0.0.0 --port 5001 --timeout-graceful-shutdown 70
+
+The event loop only moves bytes. Each request runs the Flask app on a thread
+pool, and the response chunks (SSE tokens) are handed back to the loop through
+a queue, so a slow client holds neither a request thread nor an LLM worker.
+A client that disconnects closes its response, which cancels the generation.
+uvicorn keeps HTTP/1.1 connections alive between requests (--timeout-keep-alive).
+On SIGTERM it stops accepting connections and waits for open requests; the
+lifespan shutdown then drains what is still queued for the LLM workers and
+stops them.
+"""
+import asyncio
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import server
+
+# Requests handled at the same time; streams waiting on an LLM worker each hold one thread
+HTTP_THREADS = int(os.getenv('HTTP_THREADS', '32'))
+
+class WSGIBridge:
+    """
+    Serves a WSGI app over ASGI without tying requests to a single thread
+    (asgiref's WsgiToAsgi runs every request on one shared thread)
+    """
+    
+    def __init__(self, wsgi_app, max_threads=HTTP_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="http")
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+        
+        loop = asyncio.get_running_loop()
+        body = await self._read_body(receive)
+        environ = self._environ(scope, body)
+        messages = asyncio.Queue()
+        disconnected = threading.Event()
+        
+        def emit(message):
+            loop.call_soon_threadsafe(messages.put_nowait, message)
+        
+        loop.run_in_executor(self.executor, self._run_app, environ, emit, disconnected)
+        watcher = loop.create_task(self._watch_disconnect(receive, disconnected))
+        try:
+            while True:
+                message = await messages.get()
+                if message is None:
+                    return
+                if isinstance(message, BaseException):
+                    raise message
+                await send(message)
+        finally:
+            # Also reached when the server cancels the request; stop the app either way
+            disconnected.set()
+            watcher.cancel()
+    
+    def _run_app(self, environ, emit, disconnected):
+        """Runs on a pool thread; everything for the client goes through emit"""
+        response_start = {}
+        
+        def start_response(status, headers, exc_info=None):
+            response_start.update({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [
+                    (name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in headers
+                ]
+            })
+            return lambda data: None
+        
+        def send_start():
+            if response_start:
+                emit(dict(response_start))
+                response_start.clear()
+        
+        try:
+            result = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if disconnected.is_set():
+                        break
+                    if chunk:
+                        send_start()
+                        emit({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            finally:
+                # For streams this ends the generator, which cancels the LLM job
+                if hasattr(result, 'close'):
+                    result.close()
+            send_start()
+            emit({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            emit(None)
+        except BaseException as e:
+            emit(e)
+    
+    @staticmethod
+    async def _read_body(receive):
+        body = b''
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        return body
+    
+    @staticmethod
+    async def _watch_disconnect(receive, disconnected):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                return
+    
+    @staticmethod
+    def _environ(scope, body):
+        server_name, server_port = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+            'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+                key = name
+            else:
+                key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+    
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Blocks until the generations finish, so keep it off the event loop
+                await asyncio.get_running_loop().run_in_executor(
+                    None, server.model_registry.shutdown, server.SHUTDOWN_DRAIN_SECONDS
+                )
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+app = WSGIBridge(server.app)
@@ -0,0 +1,302 @@
+import queue
+import threading
+
+import numpy as np
+import llama_cpp
+
+from kv_cache import common_prefix_length
+from metrics import CACHE_LOOKUPS, PROMPT_TOKENS_EVALUATED
+
+class BatchRequest:
+    """One sequence generated by the BatchEngine"""
+    
+    def __init__(self, prompt_tokens, max_tokens, stop, sampling, should_stop=None):
+        self.prompt_tokens = list(prompt_tokens)
+        self.max_tokens = max_tokens
+        self.stop = stop
+        self.should_stop = should_stop
+        self.sampling = sampling
+        self.completion_tokens = []
+        self.text = ""
+        self.sent = 0  # characters of text already handed to the caller
+        self.n_past = 0  # tokens of this sequence already in the KV cache
+        self._chunks = queue.Queue()
+        self._cancelled = threading.Event()
+    
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+    
+    def cancel(self):
+        self._cancelled.set()
+    
+    def chunks(self):
+        """
+        Yield completion chunks shaped like llama-cpp-python stream output
+        Closing the iterator early retires the sequence at the next decode step
+        """
+        try:
+            while True:
+                chunk = self._chunks.get()
+                if chunk is None:
+                    return
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                yield chunk
+        finally:
+            self.cancel()
+
+class BatchEngine:
+    """
+    Continuous batching on one llama.cpp context
+    Every in-flight request is a sequence id in a shared context. Each decode
+    step evaluates one new token for every generating sequence (plus chunks of
+    newly admitted prompts) in a single llama_decode call. Requests join
+    between steps and leave as soon as they hit a stop string, EOS or
+    max_tokens. A slot keeps its KV entries after a request finishes, so the
+    next prompt sharing that prefix (system prompt, same session) skips it.
+    """
+    
+    def __init__(self, llm, n_slots=4, n_ctx_per_slot=2048, n_batch=512,
+                 n_threads=None, n_threads_batch=None, last_n_tokens=64):
+        self.llm = llm
+        self.n_slots = n_slots
+        self.n_ctx_per_slot = n_ctx_per_slot
+        self.n_batch = n_batch
+        self.last_n_tokens = last_n_tokens
+        
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = n_slots * n_ctx_per_slot
+        params.n_batch = n_batch
+        params.n_ubatch = n_batch
+        params.n_seq_max = n_slots
+        params.kv_unified = True
+        if n_threads:
+            params.n_threads = n_threads
+        if n_threads_batch or n_threads:
+            params.n_threads_batch = n_threads_batch or n_threads
+        
+        self.ctx = llama_cpp.llama_init_from_model(llm.model, params)
+        if not self.ctx:
+            raise RuntimeError("Failed to create batched llama.cpp context")
+        self.memory = llama_cpp.llama_get_memory(self.ctx)
+        self.vocab = llama_cpp.llama_model_get_vocab(llm.model)
+        self.n_vocab = llama_cpp.llama_vocab_n_tokens(self.vocab)
+        self.batch = llama_cpp.llama_batch_init(n_batch, 0, 1)
+        
+        self._rng = np.random.default_rng()
+        self._pending = queue.Queue()
+        self._slots = [None] * n_slots
+        self._slot_tokens = [[] for _ in range(n_slots)]  # tokens held in each slot's KV
+        
+        self._thread = threading.Thread(target=self._loop, name="llm-batch-engine", daemon=True)
+        self._thread.start()
+    
+    @property
+    def active_sequences(self):
+        return sum(1 for request in self._slots if request is not None)
+    
+    def submit(self, prompt_tokens, max_tokens=16, stop=None, temperature=0.8, top_p=0.95,
+               top_k=40, min_p=0.05, repeat_penalty=1.0, echo=False, should_stop=None):
+        """
+        Queue a completion; returns an iterator of stream chunks
+        Takes the same sampling arguments as Llama.__call__
+        should_stop(text) is called with the completion so far after every
+        token and ends the sequence when it returns True
+        """
+        if len(prompt_tokens) + max_tokens > self.n_ctx_per_slot:
+            raise ValueError(f"Prompt too long for batch slot ({len(prompt_tokens)} tokens)")
+        
+        sampling = {
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k,
+            "min_p": min_p,
+            "repeat_penalty": repeat_penalty
+        }
+        request = BatchRequest(prompt_tokens, max_tokens, stop or [], sampling, should_stop)
+        self._pending.put(request)
+        return request.chunks()
+    
+    def _loop(self):
+        while True:
+            # Sleep on the queue only when there is nothing to decode
+            self._admit(block=self.active_sequences == 0)
+            try:
+                self._step()
+            except Exception as e:
+                # The KV contents are unknown after a failed decode, so drop them
+                for slot, request in enumerate(self._slots):
+                    if request is not None:
+                        request._chunks.put(e)
+                        self._release(slot)
+                    llama_cpp.llama_memory_seq_rm(self.memory, slot, -1, -1)
+                    self._slot_tokens[slot] = []
+    
+    def _admit(self, block):
+        """Move pending requests into free slots"""
+        while None in self._slots:
+            try:
+                request = self._pending.get(block=block)
+            except queue.Empty:
+                return
+            block = False
+            
+            if request.cancelled:
+                request._chunks.put(None)
+                continue
+            
+            # Prefer the free slot whose KV already holds the longest prefix
+            free_slots = [slot for slot, r in enumerate(self._slots) if r is None]
+            slot = max(free_slots, key=lambda s: common_prefix_length(self._slot_tokens[s], request.prompt_tokens))
+            reuse = common_prefix_length(self._slot_tokens[slot], request.prompt_tokens)
+            # The last prompt token is always evaluated so it produces logits
+            reuse = min(reuse, len(request.prompt_tokens) - 1)
+            
+            CACHE_LOOKUPS.inc(cache='prefix', result='hit' if reuse > 0 else 'miss')
+            PROMPT_TOKENS_EVALUATED.inc(len(request.prompt_tokens) - reuse)
+            
+            llama_cpp.llama_memory_seq_rm(self.memory, slot, reuse, -1)
+            self._slot_tokens[slot] = request.prompt_tokens[:reuse]
+            request.n_past = reuse
+            self._slots[slot] = request
+    
+    def _step(self):
+        n_tokens = 0
+        sample_at = []
+        
+        # Generating sequences first, so a long new prompt cannot stall them
+        for slot, request in enumerate(self._slots):
+            if request is None:
+                continue
+            if request.cancelled:
+                request._chunks.put(None)
+                self._release(slot)
+                continue
+            if request.n_past < len(request.prompt_tokens) or n_tokens >= self.n_batch:
+                continue
+            
+            token = request.completion_tokens[-1]
+            self._add_token(n_tokens, token, request.n_past, slot, True)
+            sample_at.append((slot, n_tokens))
+            n_tokens += 1
+            request.n_past += 1
+            self._slot_tokens[slot].append(token)
+        
+        # Then prompt chunks of newly admitted requests with the space left
+        for slot, request in enumerate(self._slots):
+            if request is None or request.n_past >= len(request.prompt_tokens):
+                continue
+            
+            prompt = request.prompt_tokens
+            take = min(len(prompt) - request.n_past, self.n_batch - n_tokens)
+            for pos in range(request.n_past, request.n_past + take):
+                is_last = pos == len(prompt) - 1
+                self._add_token(n_tokens, prompt[pos], pos, slot, is_last)
+                if is_last:
+                    sample_at.append((slot, n_tokens))
+                n_tokens += 1
+            self._slot_tokens[slot].extend(prompt[request.n_past:request.n_past + take])
+            request.n_past += take
+        
+        if n_tokens == 0:
+            return
+        
+        self.batch.n_tokens = n_tokens
+        result = llama_cpp.llama_decode(self.ctx, self.batch)
+        if result != 0:
+            raise RuntimeError(f"llama_decode failed with code {result}")
+        
+        for slot, index in sample_at:
+            request = self._slots[slot]
+            logits = np.ctypeslib.as_array(
+                llama_cpp.llama_get_logits_ith(self.ctx, index), shape=(self.n_vocab,)
+            )
+            self._accept(slot, request, self._sample(logits, request))
+    
+    def _add_token(self, index, token, pos, seq_id, logits):
+        self.batch.token[index] = token
+        self.batch.pos[index] = pos
+        self.batch.n_seq_id[index] = 1
+        self.batch.seq_id[index][0] = seq_id
+        self.batch.logits[index] = logits
+    
+    def _sample(self, logits, request):
+        """Same sampler chain as llama-cpp-python: penalties, top-k, top-p, min-p, temperature"""
+        params = request.sampling
+        logits = logits.astype(np.float64)
+        
+        recent = (request.prompt_tokens + request.completion_tokens)[-self.last_n_tokens:]
+        if params["repeat_penalty"] != 1.0 and recent:
+            ids = np.unique(recent)
+            penalized = logits[ids]
+            logits[ids] = np.where(penalized > 0, penalized / params["repeat_penalty"],
+                                   penalized * params["repeat_penalty"])
+        
+        if params["temperature"] <= 0:
+            return int(np.argmax(logits))
+        
+        top_k = params["top_k"] if 0 < params["top_k"] < len(logits) else len(logits)
+        candidates = np.argpartition(-logits, top_k - 1)[:top_k]
+        candidates = candidates[np.argsort(-logits[candidates])]
+        candidate_logits = logits[candidates]
+        
+        probs = _softmax(candidate_logits)
+        keep = int(np.searchsorted(np.cumsum(probs), params["top_p"])) + 1
+        candidates, candidate_logits, probs = candidates[:keep], candidate_logits[:keep], probs[:keep]
+        
+        above_min_p = probs >= params["min_p"] * probs[0]
+        candidates, candidate_logits = candidates[above_min_p], candidate_logits[above_min_p]
+        
+        probs = _softmax(candidate_logits / params["temperature"])
+        return int(self._rng.choice(candidates, p=probs))
+    
+    def _accept(self, slot, request, token):
+        if llama_cpp.llama_vocab_is_eog(self.vocab, token):
+            self._finish(slot, request)
+            return
+        
+        request.completion_tokens.append(token)
+        text = self.llm.detokenize(request.completion_tokens, prev_tokens=request.prompt_tokens)
+        request.text = text.decode('utf-8', errors='ignore')
+        
+        # Stop strings end the sequence and are not part of the output
+        stop_positions = [request.text.find(s) for s in request.stop if s in request.text]
+        if stop_positions:
+            request.text = request.text[:min(stop_positions)]
+            self._finish(slot, request)
+            return
+        
+        if len(request.completion_tokens) >= request.max_tokens:
+            self._finish(slot, request)
+            return
+        
+        if request.should_stop is not None and request.should_stop(request.text):
+            self._finish(slot, request)
+            return
+        
+        # Hold back a tail that could still become a stop string
+        safe_end = len(request.text)
+        for stop in request.stop:
+            for length in range(min(len(stop) - 1, len(request.text)), 0, -1):
+                if request.text.endswith(stop[:length]):
+                    safe_end = min(safe_end, len(request.text) - length)
+                    break
+        self._emit(request, safe_end)
+    
+    def _emit(self, request, end):
+        if end > request.sent:
+            request._chunks.put({'choices': [{'text': request.text[request.sent:end], 'finish_reason': None}]})
+            request.sent = end
+    
+    def _finish(self, slot, request):
+        self._emit(request, len(request.text))
+        request._chunks.put(None)
+        self._release(slot)
+    
+    def _release(self, slot):
+        self._slots[slot] = None
+
+def _softmax(values):
+    exp = np.exp(values - np.max(values))
+    return exp / exp.sum()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Checks download_model.ChunkedDownload against a local HTTP server
+The server serves a random file with or without Range support and can drop
+connections halfway through a chunk. Covers parallel chunks, retries after a
+dropped connection, resuming an interrupted download from its state file,
+discarding a file with the wrong SHA-256, single-stream servers, refusing to
+download without a hash and looking up the hash Hugging Face publishes.
+Exits non-zero when a check fails.
+
+Usage:
+  python benchmarks/download_test.py
+"""
+
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import download_model
+from download_model import ChunkedDownload, DownloadError
+
+FILE_SIZE = 1024 * 1024 + 12345  # last chunk is a short one
+CHUNK_SIZE = 64 * 1024
+
+class FileHandler(BaseHTTPRequestHandler):
+    """GET of server.data, honouring Range headers when server.ranges is set"""
+    
+    protocol_version = "HTTP/1.1"
+    
+    def do_GET(self):
+        if self.path.startswith("/api/"):
+            # Hugging Face's file listing, with the LFS hash of the served file
+            listing = json.dumps(self.server.listing.get(self.path, [])).encode("utf-8")
+            self.send_response(200 if self.path in self.server.listing else 404)
+            self.send_header("Content-Length", str(len(listing)))
+            self.end_headers()
+            self.wfile.write(listing)
+            return
+        
+        data = self.server.data
+        start, end = 0, len(data)
+        header = self.headers.get("Range")
+        partial = self.server.ranges and header is not None
+        if partial:
+            first, last = header.split("=", 1)[1].split("-")
+            start, end = int(first), min(int(last) + 1, len(data))
+        
+        with self.server.lock:
+            self.server.requests.append((start, end) if partial else None)
+            drop = self.server.drops.get(start, 0)
+            if drop and end - start > 1:
+                self.server.drops[start] = drop - 1
+        
+        self.send_response(206 if partial else 200)
+        self.send_header("Content-Length", str(end - start))
+        if partial:
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(data)}")
+        self.end_headers()
+        if drop and end - start > 1:
+            # Half the body, then the connection goes away
+            self.wfile.write(data[start:start + (end - start) // 2])
+            self.close_connection = True
+            return
+        try:
+            self.wfile.write(data[start:end])
+        except ConnectionError:
+            pass  # the client only wanted the headers (download_model probes with a GET)
+    
+    def log_message(self, format, *args):
+        pass
+
+class FileServer:
+    def __init__(self, data, ranges=True):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.data = data
+        self.httpd.ranges = ranges
+        self.httpd.requests = []
+        self.httpd.drops = {}  # chunk start: connections to drop
+        self.httpd.listing = {}  # API path: JSON response
+        self.httpd.lock = threading.Lock()
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/model.gguf"
+    
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self.httpd
+    
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def download(url, directory, sha256, **kwargs):
+    """ChunkedDownload.run() with its progress output swallowed"""
+    job = ChunkedDownload(url, os.path.join(directory, "model.gguf"), expected_sha256=sha256,
+                          connections=4, chunk_size=CHUNK_SIZE, **kwargs)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return job, job.run()
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def check_retry(data, sha256, directory):
+    """Every chunk loses its first connection and is fetched again"""
+    server = FileServer(data)
+    with server as httpd:
+        httpd.drops = {start: 1 for start in range(0, len(data), CHUNK_SIZE)}
+        job, digest = download(server.url, directory, sha256)
+        chunks = len(httpd.drops)
+        assert digest == sha256, "wrong digest"
+        assert read(job.filepath) == data, "file differs from the served one"
+        assert len(httpd.requests) == 1 + 2 * chunks, f"{len(httpd.requests)} requests for {chunks} chunks"
+        assert not os.path.exists(job.part_path) and not os.path.exists(job.state_path), "partial files left"
+
+def check_resume(data, sha256, directory):
+    """A chunk that keeps failing stops the run; the next run fetches only the missing chunks"""
+    server = FileServer(data)
+    failing = 3 * CHUNK_SIZE
+    with server as httpd:
+        httpd.drops = {failing: download_model.RETRIES + 1}
+        try:
+            download(server.url, directory, sha256)
+        except DownloadError:
+            pass
+        else:
+            raise AssertionError("interrupted download did not fail")
+        job = ChunkedDownload(server.url, os.path.join(directory, "model.gguf"), sha256, chunk_size=CHUNK_SIZE)
+        assert os.path.exists(job.part_path) and os.path.exists(job.state_path), "partial download not kept"
+        assert not os.path.exists(job.filepath), "unfinished file moved into place"
+        
+        with open(job.state_path) as f:
+            done = set(json.load(f)["done"])
+        assert done and failing not in done, f"state file lists {sorted(done)}"
+        
+        httpd.requests.clear()
+        job, digest = download(server.url, directory, sha256)
+        missing = set(range(0, len(data), CHUNK_SIZE)) - done
+        second_run = [request[0] for request in httpd.requests[1:]]
+        assert sorted(second_run) == sorted(missing), "resume did not fetch exactly the missing chunks"
+        assert digest == sha256 and read(job.filepath) == data, "resumed file differs"
+
+def check_bad_hash(data, sha256, directory):
+    """A file with the wrong SHA-256 is deleted, not moved into place or kept for resuming"""
+    server = FileServer(data)
+    with server:
+        try:
+            download(server.url, directory, "0" * 64)
+        except DownloadError as e:
+            assert "mismatch" in str(e), e
+        else:
+            raise AssertionError("wrong hash accepted")
+    path = os.path.join(directory, "model.gguf")
+    assert not any(os.path.exists(path + suffix) for suffix in ("", ".part", ".part.json")), "files left behind"
+
+def check_no_ranges(data, sha256, directory):
+    """Servers without Range support get one stream"""
+    server = FileServer(data, ranges=False)
+    with server as httpd:
+        job, digest = download(server.url, directory, sha256)
+        assert digest == sha256 and read(job.filepath) == data, "streamed file differs"
+        assert httpd.requests == [None, None], f"unexpected requests {httpd.requests}"
+
+def check_no_hash(data, sha256, directory):
+    """Without an expected hash nothing is downloaded unless allow_unverified is set"""
+    server = FileServer(data)
+    with server as httpd:
+        try:
+            download(server.url, directory, None)
+        except DownloadError:
+            pass
+        else:
+            raise AssertionError("unverified download allowed")
+        assert httpd.requests == [], "requests made before refusing"
+        job, digest = download(server.url, directory, None, allow_unverified=True)
+        assert digest == sha256 and read(job.filepath) == data, "unverified download differs"
+
+def check_published_hash(data, sha256, directory):
+    """The hash of a Hugging Face URL comes from the repository's LFS metadata"""
+    server = FileServer(data)
+    with server as httpd:
+        host = server.url.rsplit("/", 1)[0]
+        httpd.listing = {
+            "/api/models/owner/repo/tree/main": [
+                {"type": "file", "path": "README.md", "size": 12},
+                {"type": "file", "path": "model.gguf", "size": len(data), "lfs": {"oid": sha256, "size": len(data)}},
+            ],
+        }
+        assert download_model.published_sha256(f"{host}/owner/repo/resolve/main/model.gguf") == sha256, "wrong hash"
+        assert download_model.published_sha256(f"{host}/owner/repo/resolve/main/README.md") is None, "hash of a non-LFS file"
+        assert download_model.published_sha256(server.url) is None, "hash for a URL outside Hugging Face"
+        try:
+            download_model.published_sha256(f"{host}/owner/missing/resolve/main/model.gguf")
+        except DownloadError:
+            pass
+        else:
+            raise AssertionError("failed lookup not reported")
+
+def main():
+    data = random.Random(42).randbytes(FILE_SIZE)
+    sha256 = hashlib.sha256(data).hexdigest()
+    download_model.RETRY_DELAY = 0
+    
+    failures = 0
+    for check in (check_retry, check_resume, check_bad_hash, check_no_ranges, check_no_hash,
+                  check_published_hash):
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                check(data, sha256, directory)
+                print(f"ok    {check.__name__}")
+            except AssertionError as e:
+                failures += 1
+                print(f"FAIL  {check.__name__}: {e}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
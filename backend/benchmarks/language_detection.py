@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark LanguageDetector against the old regex-alternation detector
+Prints microseconds per message for both and lists the messages they
+classify differently
+
+Usage:
+  python benchmarks/language_detection.py [--corpus benchmarks/messages.txt] [--repeat 2000]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from language_detector import LanguageDetector
+
+def legacy_detect_language(text):
+    """The detector LLMHandler used before LanguageDetector, kept for comparison"""
+    hinglish_patterns = [
+        r'\b(hai|hain|ho|tha|thi|the|ka|ki|ke|ko|kya|kaise|kyun|abhi|bohot|bahut|achha|acha|thik|nahi|nahin|haan|haa|bhai|yaar|dost|accha|kuch|koi|matlab|samajh|pata|kaisa|kaisi|aise|waise|apna|mera|tera|uska|sabse|bilkul|sahi|galat|tension|chill|bas|aur|lekin|par|toh|to|hua|hui|hue|raha|rahi|rahe|laga|lagi|lage|mil|mila|mili|mile|dena|diya|diye|lena|liya|liye|dekh|dekha|dekhi|dekhe|sun|suna|suni|sune|kaam|kaam|padh|padha|padhi|jana|gaya|gayi|gaye|aana|aaya|aayi|aaye|karna|kiya|kiye|hona|hogaya|hogayi|hogaye)\b',
+        r'[क-ह]'
+    ]
+    
+    for pattern in hinglish_patterns:
+        if re.search(pattern, text.lower()):
+            return 'hinglish'
+    return 'english'
+
+def time_per_call(detect, messages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for message in messages:
+            detect(message)
+    return (time.perf_counter() - start) / (repeat * len(messages)) * 1e6
+
+def main():
+    default_corpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'messages.txt')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default=default_corpus, help="one message per line")
+    parser.add_argument('--repeat', type=int, default=2000, help="passes over the corpus per detector")
+    args = parser.parse_args()
+    
+    with open(args.corpus, encoding='utf-8') as f:
+        messages = [line.strip() for line in f if line.strip()]
+    
+    detector = LanguageDetector()
+    legacy_us = time_per_call(legacy_detect_language, messages, args.repeat)
+    detector_us = time_per_call(detector.detect, messages, args.repeat)
+    
+    print(f"Messages:           {len(messages)}")
+    print(f"legacy regex:       {legacy_us:8.2f} us/message")
+    print(f"LanguageDetector:   {detector_us:8.2f} us/message")
+    
+    differences = [
+        (message, legacy_detect_language(message), detector.analyze(message))
+        for message in messages
+        if legacy_detect_language(message) != detector.detect(message)
+    ]
+    print(f"Classified differently: {len(differences)}")
+    for message, legacy, result in differences:
+        print(f"  {legacy:>8} -> {result['language']:<8} ({result['confidence']:.2f})  {message}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Latency and throughput benchmark for the backend
+Micro-benchmarks SentimentAnalyzer.analyze, LLMHandler.detect_language and the
+output cleanup on their own, then replays the message corpus against
+/api/chat, /api/chat/stream and /api/sentiment from concurrent clients.
+Reports throughput, p50/p95/p99 latency and time to first token, and saves
+everything as JSON; --compare prints the change against an earlier run.
+
+By default the server runs in-process on a stub Llama (benchmarks/stub_llama.py)
+with synthetic per-token timings, so results only depend on the code. --model
+uses a real (ideally tiny) GGUF file instead, --url drives a running server.
+
+Usage:
+  python benchmarks/load_test.py [--concurrency 4] [--requests 200] [--workers 2]
+  python benchmarks/load_test.py --model /path/to/tiny.gguf
+  python benchmarks/load_test.py --url http://localhost:5001 --compare benchmarks/results/previous.json
+"""
+
+import argparse
+import atexit
+import http.client
+import importlib.util
+import json
+import logging
+import os
+import platform
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..'))
+
+import stub_llama
+
+ENDPOINTS = {
+    'chat': '/api/chat',
+    'chat_stream': '/api/chat/stream',
+    'sentiment': '/api/sentiment',
+}
+
+def percentiles(values, scale=1.0):
+    if not values:
+        return None
+    values = np.asarray(values) * scale
+    return {
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+        "mean": round(float(values.mean()), 3),
+        "max": round(float(values.max()), 3)
+    }
+
+def load_corpus(path):
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+# --- Micro-benchmarks ---
+
+def time_calls(func, inputs, repeat):
+    """Per-call timings in microseconds and calls/sec over all calls"""
+    timings = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in inputs:
+            call_started = time.perf_counter_ns()
+            func(item)
+            timings.append((time.perf_counter_ns() - call_started) / 1000)
+    elapsed = time.perf_counter() - started
+    return {"calls": len(timings), "calls_per_sec": round(len(timings) / elapsed, 1), "latency_us": percentiles(timings)}
+
+def run_micro(messages, repeat):
+    from sentiment_analyzer import SentimentAnalyzer
+    from llm_handler import LLMHandler
+    from output_filter import clean_response, StreamFilter
+    
+    # Uncached, so repeated messages measure scoring rather than cache lookups
+    analyzer = SentimentAnalyzer(cache_size=0)
+    raw_outputs = stub_llama.REPLIES + [f"<|im_start|>{reply}<|im_end|>" for reply in stub_llama.REPLIES]
+    
+    def stream_cleanup(raw_text):
+        stream_filter = StreamFilter(stop_at_ai_phrase=True)
+        for word in stub_llama.WORD_PATTERN.findall(raw_text):
+            stream_filter.feed(word)
+            if stream_filter.complete:
+                break
+        stream_filter.finish('neutral', 'english')
+    
+    return {
+        "sentiment_analyze": time_calls(analyzer.analyze, messages, repeat),
+        "detect_language": time_calls(LLMHandler.detect_language, messages, repeat),
+        "clean_response": time_calls(lambda text: clean_response(text, 'neutral', 'english'), raw_outputs, repeat),
+        "stream_filter": time_calls(stream_cleanup, raw_outputs, repeat)
+    }
+
+# --- Load test ---
+
+def start_server(args):
+    """Run the Flask app in this process on a free port; returns its URL"""
+    if args.model:
+        model_path = os.path.abspath(args.model)
+    else:
+        # The loader only checks that the file exists
+        model_path = tempfile.NamedTemporaryFile(prefix="stub-model-", suffix=".gguf", delete=False).name
+        atexit.register(os.remove, model_path)
+    
+    # MODEL_NAME may be an absolute path (os.path.join keeps it)
+    os.environ['MODEL_NAME'] = model_path
+    os.environ['LLM_WORKERS'] = str(args.workers)
+    os.environ['LLM_QUEUE_SIZE'] = str(max(16, args.concurrency * 2))
+    os.environ['RESPONSE_CACHE_SIZE'] = os.environ.get('RESPONSE_CACHE_SIZE', '1024') if args.response_cache else '0'
+    os.environ['DEBUG_LOG_SAMPLE_RATE'] = '0'
+    
+    from werkzeug.serving import make_server
+    import server
+    
+    # Werkzeug logs every request line
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    
+    if not server.model_registry.wait(timeout=600):
+        sys.exit(f"Model did not load: {server.model_registry.default_status()}")
+    
+    httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{httpd.server_port}"
+
+def send_request(connection, endpoint, message, session_id):
+    """
+    One request on a keep-alive connection
+    Returns (HTTP status, seconds until the first token or None)
+    """
+    body = {"text": message} if endpoint == 'sentiment' else {"message": message, "session_id": session_id}
+    started = time.perf_counter()
+    connection.request('POST', ENDPOINTS[endpoint], json.dumps(body), {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    
+    first_token = None
+    if endpoint == 'chat_stream' and response.status == 200:
+        while True:
+            line = response.readline()
+            if not line:
+                break
+            if first_token is None and line.startswith(b'event: token'):
+                first_token = time.perf_counter() - started
+    else:
+        response.read()
+    return response.status, first_token
+
+def run_load(url, endpoint, messages, concurrency, total, seed):
+    """Replay `total` corpus messages (seeded order) from `concurrency` clients"""
+    rng = random.Random(seed)
+    work = queue.Queue()
+    for _ in range(total):
+        work.put(messages[rng.randrange(len(messages))])
+    
+    target = urlsplit(url)
+    run_id = uuid.uuid4().hex[:8]
+    latencies = []
+    first_tokens = []
+    statuses = {}
+    lock = threading.Lock()
+    
+    def client(index):
+        connection = http.client.HTTPConnection(target.hostname, target.port, timeout=300)
+        # Each client is one chat session, so history and prefix reuse build up like in real use
+        session_id = f"bench-{run_id}-{endpoint}-{index}"
+        while True:
+            try:
+                message = work.get_nowait()
+            except queue.Empty:
+                break
+            started = time.perf_counter()
+            try:
+                status, first_token = send_request(connection, endpoint, message, session_id)
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection(target.hostname, target.port, timeout=300)
+                status, first_token = 'connection_error', None
+            elapsed = time.perf_counter() - started
+            with lock:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status == 200:
+                    latencies.append(elapsed)
+                    if first_token is not None:
+                        first_tokens.append(first_token)
+        connection.close()
+    
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    wall_seconds = time.perf_counter() - started
+    
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "statuses": statuses,
+        "errors": total - len(latencies),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(latencies) / wall_seconds, 2),
+        "latency_ms": percentiles(latencies, 1000),
+        "ttft_ms": percentiles(first_tokens, 1000)
+    }
+
+# --- Reporting ---
+
+def flatten(results, prefix=""):
+    """{'load.chat.latency_ms.p95': value, ...} for the numbers worth comparing"""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and key in ('p50', 'p95', 'p99', 'throughput_rps', 'calls_per_sec'):
+            flat[path] = value
+    return flat
+
+def print_summary(results):
+    for name, micro in results.get("micro", {}).items():
+        latency = micro["latency_us"]
+        print(f"{name:<20} {micro['calls_per_sec']:>12.0f} calls/s   "
+              f"p50 {latency['p50']:>8.1f} us   p95 {latency['p95']:>8.1f} us   p99 {latency['p99']:>8.1f} us")
+    for name, load in results.get("load", {}).items():
+        line = f"{name:<20} {load['throughput_rps']:>12.2f} req/s    errors {load['errors']}"
+        if load["latency_ms"]:
+            latency = load["latency_ms"]
+            line += f"   p50 {latency['p50']:.0f} ms   p95 {latency['p95']:.0f} ms   p99 {latency['p99']:.0f} ms"
+        if load["ttft_ms"]:
+            line += f"   ttft p50 {load['ttft_ms']['p50']:.0f} ms   p95 {load['ttft_ms']['p95']:.0f} ms"
+        print(line)
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = flatten(json.load(f))
+    current = flatten(results)
+    print(f"\nChange against {baseline_path} (latency: lower is better, throughput: higher is better)")
+    for path in sorted(set(baseline) & set(current)):
+        if baseline[path]:
+            change = (current[path] - baseline[path]) / baseline[path] * 100
+            print(f"  {path:<45} {baseline[path]:>12.2f} -> {current[path]:>12.2f}  ({change:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default=os.path.join(BENCHMARK_DIR, 'messages.txt'), help="one message per line")
+    parser.add_argument('--model', help="GGUF file to load instead of the stub Llama")
+    parser.add_argument('--url', help="benchmark a running server instead of starting one")
+    parser.add_argument('--endpoints', default="chat,chat_stream,sentiment", help="comma-separated subset of " + ",".join(ENDPOINTS))
+    parser.add_argument('--concurrency', type=int, default=4, help="concurrent clients per endpoint")
+    parser.add_argument('--requests', type=int, default=200, help="requests per endpoint")
+    parser.add_argument('--workers', type=int, default=2, help="LLM workers of the in-process server")
+    parser.add_argument('--response-cache', action='store_true', help="keep the response cache on (off by default so every chat hits the model)")
+    parser.add_argument('--stub-prompt-ms', type=float, default=0.2, help="stub prompt eval time per token")
+    parser.add_argument('--stub-token-ms', type=float, default=30, help="stub decode time per token")
+    parser.add_argument('--micro-repeat', type=int, default=200, help="passes over the corpus per micro-benchmark")
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--skip-load', action='store_true')
+    parser.add_argument('--seed', type=int, default=42, help="message order of the replay")
+    parser.add_argument('--output', help="JSON results file (default benchmarks/results/<time>.json)")
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    args = parser.parse_args()
+    
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    
+    # The stub stands in for the model here, unless one is given; against a
+    # running server it is only needed if llama_cpp is not installed
+    if not args.model and not (args.url and importlib.util.find_spec('llama_cpp')):
+        stub_llama.install(args.stub_prompt_ms / 1000, args.stub_token_ms / 1000)
+    
+    messages = load_corpus(args.corpus)
+    results = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": vars(args),
+        "backend": "url" if args.url else ("model" if args.model else "stub"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "corpus_messages": len(messages)
+    }
+    
+    if not args.skip_micro:
+        results["micro"] = run_micro(messages, args.micro_repeat)
+    
+    if not args.skip_load:
+        url = args.url or start_server(args)
+        results["load"] = {
+            endpoint: run_load(url, endpoint, messages, args.concurrency, args.requests, args.seed)
+            for endpoint in endpoints
+        }
+    
+    print()
+    print_summary(results)
+    
+    output = args.output or os.path.join(BENCHMARK_DIR, 'results', time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {output}")
+    
+    if args.compare:
+        print_comparison(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark SentimentAnalyzer.analyze vs analyze_batch
+Prints texts/sec for both paths and checks that they give the same scores
+
+Usage:
+  python benchmarks/sentiment_batch.py [--texts 20000] [--workers 4]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sentiment_analyzer import SentimentAnalyzer
+
+# Fragments the synthetic journal/mood entries are built from
+FRAGMENTS = [
+    "had a good day at work", "feeling really tired", "I am so happy today",
+    "exam stress is killing me", "not feeling great", "kya haal hai bhai",
+    "slept well for once", "everything feels pointless", "love this weather",
+    "my friend made me laugh", "ugh, mondays", "anxious about tomorrow",
+    "it was okay I guess", "best day ever!!", "why does this keep happening??",
+    "yaar aaj bahut bura din tha", "grateful for my family", "can't sleep again",
+    "went for a long walk", "feeling lonely tonight", "proud of myself 😊",
+]
+
+def make_corpus(count, seed=42):
+    rng = random.Random(seed)
+    return [
+        ". ".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 4)))
+        for _ in range(count)
+    ]
+
+def scores_match(a, b, tolerance=1e-3):
+    return a['sentiment'] == b['sentiment'] and all(
+        abs(a['scores'][key] - b['scores'][key]) <= tolerance for key in a['scores']
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--texts', type=int, default=20000, help="number of texts to score")
+    parser.add_argument('--workers', type=int, default=0, help="also time analyze_batch with a process pool")
+    args = parser.parse_args()
+    
+    analyzer = SentimentAnalyzer(cache_size=0)
+    texts = make_corpus(args.texts)
+    
+    start = time.perf_counter()
+    single = [analyzer.analyze(text) for text in texts]
+    single_seconds = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    batch = analyzer.analyze_batch(texts)
+    batch_seconds = time.perf_counter() - start
+    
+    mismatches = sum(1 for a, b in zip(single, batch) if not scores_match(a, b))
+    
+    print(f"Texts:                {len(texts)}")
+    print(f"analyze (per text):   {len(texts) / single_seconds:10.0f} texts/sec")
+    print(f"analyze_batch:        {len(texts) / batch_seconds:10.0f} texts/sec")
+    
+    if args.workers > 1:
+        start = time.perf_counter()
+        pooled = analyzer.analyze_batch(texts, workers=args.workers)
+        pooled_seconds = time.perf_counter() - start
+        mismatches += sum(1 for a, b in zip(single, pooled) if not scores_match(a, b))
+        print(f"analyze_batch x{args.workers}:     {len(texts) / pooled_seconds:10.0f} texts/sec")
+    
+    print(f"Mismatches:           {mismatches}")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
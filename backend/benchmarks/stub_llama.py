@@ -0,0 +1,156 @@
+"""
+Stand-in for llama_cpp.Llama so the load test runs without a model file
+Tokens are UTF-8 bytes. Prompt evaluation and decoding sleep for a fixed time
+per token (prompt tokens already in the context are free, like llama.cpp's
+prefix reuse), and the reply is picked from REPLIES by a hash of the prompt,
+so runs are repeatable. The timings are synthetic: this measures the server
+around the model (queueing, streaming, cleanup, caches), not the model.
+Batched generation (LLM_BATCH_SLOTS) needs the real low-level API and is not
+supported.
+"""
+
+import hashlib
+import re
+import sys
+import time
+import types
+
+import numpy as np
+
+BOS = 256
+
+# Raw model outputs, including ones the output filter has to cut or replace
+REPLIES = [
+    "Hey, that sounds like a lot. Want to talk about it?",
+    "Arre yaar, kya hua? Bata na, main sun raha hoon.",
+    "Nice! That's awesome to hear 😊 What made it so good?",
+    "I'm here for you. As an AI I can't hug you, but I'm listening.",
+    "Haha same here bro. Kal ka plan kya hai?\nuser: also tell me",
+    "That's rough. Sleep is so important. Maybe try winding down early tonight. You got this.",
+    "Aww, proud of you! It seems like you worked really hard for this.",
+    "Hmm",
+]
+
+# One stream chunk per word, trailing whitespace included
+WORD_PATTERN = re.compile(r"\S+\s*|\s+")
+
+class LlamaState:
+    def __init__(self, input_ids, scores, n_tokens, llama_state, llama_state_size, seed):
+        self.input_ids = input_ids
+        self.scores = scores
+        self.n_tokens = n_tokens
+        self.llama_state = llama_state
+        self.llama_state_size = llama_state_size
+        self.seed = seed
+
+def llama_state_get_size(ctx):
+    return ctx.n_tokens * 128  # rough KV size, only used for cache accounting
+
+def llama_state_get_data(ctx, buffer, size):
+    return size
+
+class StoppingCriteriaList(list):
+    def __call__(self, input_ids, logits):
+        return any(criterion(input_ids, logits) for criterion in self)
+
+class Llama:
+    # Set by install()
+    prompt_seconds_per_token = 0.0002
+    seconds_per_token = 0.03
+    
+    def __init__(self, model_path, n_ctx=4096, **kwargs):
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.input_ids = np.zeros(n_ctx, dtype=np.intc)
+        self.scores = np.zeros((1, 8), dtype=np.single)
+        self.n_tokens = 0
+        # What kv_cache reads to snapshot the context
+        self._ctx = types.SimpleNamespace(ctx=self)
+        self._seed = 0
+    
+    @property
+    def _input_ids(self):
+        return self.input_ids[:self.n_tokens]
+    
+    @property
+    def _scores(self):
+        return self.scores[:self.n_tokens]
+    
+    def tokenize(self, text, add_bos=True, special=False):
+        return ([BOS] if add_bos else []) + list(text)
+    
+    def detokenize(self, tokens, prev_tokens=None, special=False):
+        return bytes(token for token in tokens if token < BOS)
+    
+    def reset(self):
+        self.n_tokens = 0
+    
+    def eval(self, tokens):
+        tokens = list(tokens)
+        end = self.n_tokens + len(tokens)
+        if end > self.n_ctx:
+            raise ValueError(f"Context full ({end} > {self.n_ctx} tokens)")
+        self.input_ids[self.n_tokens:end] = tokens
+        self.n_tokens = end
+    
+    def load_state(self, state):
+        self.input_ids = state.input_ids.copy()
+        self.n_tokens = state.n_tokens
+    
+    def __call__(self, prompt, max_tokens=16, stop=None, stream=False, stopping_criteria=None, **kwargs):
+        chunks = self._generate(list(prompt), max_tokens, stop or [], stopping_criteria)
+        if stream:
+            return chunks
+        return {'choices': [{'text': "".join(chunk['choices'][0]['text'] for chunk in chunks)}]}
+    
+    def _generate(self, prompt, max_tokens, stop, stopping_criteria):
+        reuse = 0
+        for cached, token in zip(self._input_ids, prompt[:-1]):
+            if cached != token:
+                break
+            reuse += 1
+        self.n_tokens = reuse
+        time.sleep(self.prompt_seconds_per_token * (len(prompt) - reuse))
+        self.eval(prompt[reuse:])
+        
+        digest = hashlib.sha1(repr(prompt[-256:]).encode('utf-8')).digest()
+        reply = REPLIES[int.from_bytes(digest[:4], 'little') % len(REPLIES)]
+        
+        text = ""
+        for word in WORD_PATTERN.findall(reply)[:max_tokens]:
+            if stopping_criteria is not None and stopping_criteria(self._input_ids, None):
+                return
+            time.sleep(self.seconds_per_token)
+            
+            # Stop strings end the output and are not part of it
+            stop_positions = [(text + word).find(s) for s in stop if s in text + word]
+            if stop_positions:
+                word = (text + word)[len(text):min(stop_positions)]
+                if word:
+                    yield {'choices': [{'text': word, 'finish_reason': 'stop'}]}
+                return
+            
+            text += word
+            self.eval(word.encode('utf-8'))
+            yield {'choices': [{'text': word, 'finish_reason': None}]}
+
+def install(prompt_seconds_per_token=None, seconds_per_token=None):
+    """Register this module's Llama as llama_cpp; call before importing the backend"""
+    if prompt_seconds_per_token is not None:
+        Llama.prompt_seconds_per_token = prompt_seconds_per_token
+    if seconds_per_token is not None:
+        Llama.seconds_per_token = seconds_per_token
+    
+    module = types.ModuleType('llama_cpp')
+    module.Llama = Llama
+    module.LlamaState = LlamaState
+    module.llama_state_get_size = llama_state_get_size
+    module.llama_state_get_data = llama_state_get_data
+    module.StoppingCriteriaList = StoppingCriteriaList
+    sys.modules['llama_cpp'] = module
+    
+    # Imported by speculative.py; the stub never drafts
+    speculative = types.ModuleType('llama_cpp.llama_speculative')
+    speculative.LlamaDraftModel = object
+    module.llama_speculative = speculative
+    sys.modules['llama_cpp.llama_speculative'] = speculative
@@ -0,0 +1,87 @@
+class ChatTemplate:
+    """
+    Prompt format of a model family
+    system, message and assistant_prefix are format strings; message gets
+    {role} (after role_names) and {text}. stop ends a reply, and
+    special_tokens are stripped from model output should they leak into it.
+    The BOS token is not part of the template; the tokenizer adds it.
+    """
+    
+    def __init__(self, name, system, message, assistant_prefix, stop, special_tokens, role_names=None):
+        self.name = name
+        self.system = system
+        self.message_format = message
+        self.assistant_prefix = assistant_prefix
+        self.stop = list(stop)
+        self.special_tokens = list(special_tokens)
+        self.role_names = role_names or {}
+    
+    def system_block(self, text):
+        return self.system.format(text=text)
+    
+    def message(self, role, text):
+        """One message block; role is 'user' or 'assistant'"""
+        return self.message_format.format(role=self.role_names.get(role, role), text=text)
+    
+    def turn(self, role, text):
+        """Message block of a session_store.Turn role ('user' or 'bot')"""
+        return self.message('user' if role == 'user' else 'assistant', text)
+
+CHAT_TEMPLATES = {
+    # OpenHermes, and most Mistral fine-tunes
+    "chatml": ChatTemplate(
+        "chatml",
+        system="<|im_start|>system\n{text}<|im_end|>\n",
+        message="<|im_start|>{role}\n{text}<|im_end|>\n",
+        assistant_prefix="<|im_start|>assistant\n",
+        stop=["<|im_end|>", "<|im_start|>"],
+        special_tokens=["<|im_end|>", "<|im_start|>"]
+    ),
+    # TinyLlama-1.1B-Chat
+    "zephyr": ChatTemplate(
+        "zephyr",
+        system="<|system|>\n{text}</s>\n",
+        message="<|{role}|>\n{text}</s>\n",
+        assistant_prefix="<|assistant|>\n",
+        stop=["</s>", "<|user|>", "<|system|>"],
+        special_tokens=["</s>", "<|user|>", "<|assistant|>", "<|system|>"]
+    ),
+    "llama3": ChatTemplate(
+        "llama3",
+        system="<|start_header_id|>system<|end_header_id|>\n\n{text}<|eot_id|>",
+        message="<|start_header_id|>{role}<|end_header_id|>\n\n{text}<|eot_id|>",
+        assistant_prefix="<|start_header_id|>assistant<|end_header_id|>\n\n",
+        stop=["<|eot_id|>", "<|start_header_id|>"],
+        special_tokens=["<|eot_id|>", "<|start_header_id|>", "<|end_header_id|>"]
+    ),
+    # Gemma has no system role; the instructions go in a leading user turn
+    "gemma": ChatTemplate(
+        "gemma",
+        system="<start_of_turn>user\n{text}<end_of_turn>\n",
+        message="<start_of_turn>{role}\n{text}<end_of_turn>\n",
+        assistant_prefix="<start_of_turn>model\n",
+        stop=["<end_of_turn>", "<start_of_turn>"],
+        special_tokens=["<end_of_turn>", "<start_of_turn>"],
+        role_names={"assistant": "model"}
+    ),
+    # Phi-2 is not chat-tuned; plain "Role: text" lines work best
+    "phi2": ChatTemplate(
+        "phi2",
+        system="System: {text}\n",
+        message="{role}: {text}\n",
+        assistant_prefix="Assistant:",
+        stop=["<|endoftext|>", "\nUser", "\nSystem"],
+        special_tokens=["<|endoftext|>"],
+        role_names={"user": "User", "assistant": "Assistant"}
+    ),
+}
+
+# Every template's special tokens, for cleaning output of any model
+SPECIAL_TOKENS = sorted({token for template in CHAT_TEMPLATES.values() for token in template.special_tokens})
+
+def get_chat_template(name):
+    """Look up a template by name; raises ValueError for unknown names"""
+    try:
+        return CHAT_TEMPLATES[name]
+    except KeyError:
+        raise ValueError(f"Unknown chat template '{name}' (known: {', '.join(CHAT_TEMPLATES)})")
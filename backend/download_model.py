@@ -2,77 +2,306 @@
 """
 Script to download a lightweight LLM model for SleepyHead
 Downloads TinyLlama-1.1B-Chat (GGUF format) - perfect for chatbots
+
+Interrupted downloads resume where they stopped when the script is run again.
+Downloads are checked against the SHA-256 Hugging Face publishes for the file
+(or a pinned one); without any hash the script refuses unless
+--allow-unverified is given.
+Non-interactive use, e.g. in provisioning scripts:
+    python download_model.py --model openhermes --yes
 """
 
+import argparse
+import hashlib
+import json
 import os
+import re
 import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 # Model configuration
+# "sha256" pins the hash checked before the file is moved into place; entries without one
+# are checked against the SHA-256 Hugging Face publishes for the file (published_sha256)
 MODELS = {
     "tinyllama": {
         "name": "TinyLlama-1.1B-Chat-v1.0",
         "url": "https://huggingface.co/TheBloke/TinyLlama-1.1B-Chat-v1.0-GGUF/resolve/main/tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf",
         "filename": "tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf",
         "size": "~669 MB",
-        "description": "Ultra-light, fast. Great for testing."
+        "description": "Ultra-light, fast. Great for testing.",
+        "chat_template": "zephyr",
+        "n_ctx": 2048,
+        "sha256": None
     },
     "phi2": {
         "name": "Phi-2-Chat",
         "url": "https://huggingface.co/TheBloke/phi-2-GGUF/resolve/main/phi-2.Q4_K_M.gguf",
         "filename": "phi-2.Q4_K_M.gguf",
         "size": "~1.6 GB",
-        "description": "Microsoft’s Phi-2, strong reasoning for small size."
+        "description": "Microsoft’s Phi-2, strong reasoning for small size.",
+        "chat_template": "phi2",
+        "n_ctx": 2048,
+        "sha256": None
     },
     "gemma7b": {
         "name": "Gemma-7B-it",
         "url": "https://huggingface.co/TheBloke/gemma-7b-it-GGUF/resolve/main/gemma-7b-it.Q4_K_M.gguf",
         "filename": "gemma-7b-it.Q4_K_M.gguf",
         "size": "~5.0 GB",
-        "description": "Google’s Gemma 7B, multilingual (handles Hinglish), empathetic responses."
+        "description": "Google’s Gemma 7B, multilingual (handles Hinglish), empathetic responses.",
+        "chat_template": "gemma",
+        "n_ctx": 4096,
+        "sha256": None
     },
     "openhermes": {
         "name": "OpenHermes-2.5-Mistral-7B",
         "url": "https://huggingface.co/TheBloke/OpenHermes-2.5-Mistral-7B-GGUF/resolve/main/openhermes-2.5-mistral-7b.Q4_K_M.gguf",
         "filename": "openhermes-2.5-mistral-7b.Q4_K_M.gguf",
         "size": "~4.5 GB",
-        "description": "Therapist-style, fine-tuned for roleplay and empathy."
+        "description": "Therapist-style, fine-tuned for roleplay and empathy.",
+        "chat_template": "chatml",
+        "n_ctx": 4096,
+        "sha256": None
     },
     "llama3": {
         "name": "LLaMA-3-8B-Instruct",
         "url": "https://huggingface.co/TheBloke/Llama-3-8B-Instruct-GGUF/resolve/main/llama-3-8b-instruct.Q4_K_M.gguf",
         "filename": "llama-3-8b-instruct.Q4_K_M.gguf",
         "size": "~4.8 GB",
-        "description": "Meta’s newest, excellent reasoning + Hinglish understanding."
+        "description": "Meta’s newest, excellent reasoning + Hinglish understanding.",
+        "chat_template": "llama3",
+        "n_ctx": 4096,
+        "sha256": None
     }
 }
 
-def download_file_simple(url, filepath):
-    """Download file with simple progress indicator"""
-    import urllib.request
-    
-    print(f"\nDownloading from: {url}")
-    print(f"Saving to: {filepath}")
-    print("Please wait, this may take several minutes...\n")
-    
-    def report_progress(block_num, block_size, total_size):
-        downloaded = block_num * block_size
-        if total_size > 0:
-            percent = min(downloaded * 100.0 / total_size, 100)
-            downloaded_mb = downloaded / (1024 * 1024)
-            total_mb = total_size / (1024 * 1024)
-            
-            # Print every 5%
-            if int(percent) % 5 == 0 and block_num > 0:
-                print(f"\rProgress: {percent:.1f}% ({downloaded_mb:.1f}/{total_mb:.1f} MB)", end='', flush=True)
+# Parallel downloads split the file into chunks of this size; an interrupted download resumes per chunk
+CHUNK_SIZE = 16 * 1024 * 1024
+CONNECTIONS = 4
+RETRIES = 3
+RETRY_DELAY = 1  # seconds, doubled after every failed attempt
+READ_SIZE = 1024 * 1024
+
+# Hugging Face file URLs: <host>/<owner>/<repo>/resolve/<revision>/<path>
+HF_FILE_PATTERN = re.compile(r"^(https?://[^/]+)/([^/]+/[^/]+)/resolve/([^/]+)/(.+)$")
+
+class DownloadError(Exception):
+    pass
+
+class ChunkedDownload:
+    """
+    Download of one file into <file>.part, resumable across runs
+    Servers that accept Range requests get `connections` parallel chunk
+    downloads into the preallocated file; the finished chunks are recorded in
+    <file>.part.json so a rerun only fetches the rest. Other servers get a
+    single stream. The file is renamed into place only after its size and
+    SHA-256 check out; without an expected hash nothing is downloaded unless
+    allow_unverified is set.
+    """
+    
+    def __init__(self, url, filepath, expected_sha256=None, connections=CONNECTIONS, chunk_size=CHUNK_SIZE,
+                 allow_unverified=False):
+        self.url = url
+        self.filepath = str(filepath)
+        self.part_path = self.filepath + ".part"
+        self.state_path = self.part_path + ".json"
+        self.expected_sha256 = expected_sha256.lower() if expected_sha256 else None
+        self.allow_unverified = allow_unverified
+        self.connections = max(1, connections)
+        self.chunk_size = chunk_size
+        self.total_size = 0
+        self.downloaded = 0
+        self._done = set()  # start offsets of finished chunks
+        self._lock = threading.Lock()
+        self._last_report = 0
+        self._cancelled = threading.Event()
+    
+    def run(self):
+        """Download, verify and move into place; returns the SHA-256 of the file"""
+        if not self.expected_sha256 and not self.allow_unverified:
+            raise DownloadError("No SHA-256 to verify the download against")
+        print(f"\nDownloading from: {self.url}")
+        print(f"Saving to: {self.filepath}")
+        
+        self.total_size, ranges = self._probe()
+        if ranges and self.total_size > 0:
+            self._download_chunks()
+        else:
+            print("Server does not support resuming, downloading in one stream")
+            self._download_stream()
+        print()  # New line after progress
+        
+        size = os.path.getsize(self.part_path)
+        if self.total_size and size != self.total_size:
+            raise DownloadError(f"Size mismatch: expected {self.total_size} bytes, got {size}")
+        
+        print("Verifying SHA-256...")
+        digest = file_sha256(self.part_path)
+        if self.expected_sha256 and digest != self.expected_sha256:
+            # A corrupt file must not be resumed either
+            self.discard()
+            raise DownloadError(f"SHA-256 mismatch: expected {self.expected_sha256}, got {digest}")
+        
+        os.replace(self.part_path, self.filepath)
+        self._remove(self.state_path)
+        return digest
+    
+    def discard(self):
+        """Delete the partial download"""
+        self._remove(self.part_path)
+        self._remove(self.state_path)
+    
+    def _probe(self):
+        """Size of the file and whether the server honours Range requests"""
+        request = urllib.request.Request(self.url, headers={"Range": "bytes=0-0"})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            content_range = response.headers.get("Content-Range", "")
+            if response.status == 206 and "/" in content_range and not content_range.endswith("/*"):
+                return int(content_range.rsplit("/", 1)[1]), True
+            return int(response.headers.get("Content-Length") or 0), False
+    
+    def _download_chunks(self):
+        self._load_state()
+        with open(self.part_path, "r+b" if os.path.exists(self.part_path) else "w+b") as f:
+            f.truncate(self.total_size)  # preallocate
+        
+        pending = [start for start in range(0, self.total_size, self.chunk_size) if start not in self._done]
+        self.downloaded = sum(self._chunk_end(start) - start for start in self._done)
+        if self._done:
+            print(f"Resuming: {self.downloaded / (1024 * 1024):.1f} MB already downloaded")
+        
+        executor = ThreadPoolExecutor(max_workers=self.connections)
+        futures = [executor.submit(self._download_chunk, start) for start in pending]
+        try:
+            for future in as_completed(futures):
+                future.result()
+        except BaseException:
+            # Ctrl-C or a failed chunk: stop the other chunks, keep what is finished
+            self._cancelled.set()
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+    
+    def _download_chunk(self, start):
+        end = self._chunk_end(start)
+        for attempt in range(RETRIES + 1):
+            received = 0
+            try:
+                request = urllib.request.Request(self.url, headers={"Range": f"bytes={start}-{end - 1}"})
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    if response.status != 206 or not response.headers.get("Content-Range", "").startswith(f"bytes {start}-"):
+                        raise DownloadError(f"Server ignored the range request for bytes {start}-{end - 1}")
+                    with open(self.part_path, "r+b") as f:
+                        f.seek(start)
+                        while received < end - start:
+                            if self._cancelled.is_set():
+                                return
+                            data = response.read(min(READ_SIZE, end - start - received))
+                            if not data:
+                                raise DownloadError(f"Connection closed at byte {start + received}")
+                            f.write(data)
+                            received += len(data)
+                            self._progress(len(data))
+                break
+            except (OSError, DownloadError) as e:
+                self._progress(-received)
+                if attempt == RETRIES or self._cancelled.is_set():
+                    raise DownloadError(f"Chunk at byte {start} failed after {RETRIES + 1} attempts: {e}")
+                time.sleep(RETRY_DELAY * 2 ** attempt)
+        
+        with self._lock:
+            self._done.add(start)
+            self._save_state()
+    
+    def _download_stream(self):
+        self._remove(self.state_path)
+        with urllib.request.urlopen(self.url, timeout=60) as response, open(self.part_path, "wb") as f:
+            self.downloaded = 0
+            while True:
+                data = response.read(READ_SIZE)
+                if not data:
+                    break
+                f.write(data)
+                self._progress(len(data))
+    
+    def _chunk_end(self, start):
+        return min(start + self.chunk_size, self.total_size)
+    
+    def _load_state(self):
+        """Finished chunks of an earlier run of the same download"""
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        same_download = (
+            state.get("url") == self.url and state.get("size") == self.total_size
+            and state.get("chunk_size") == self.chunk_size and os.path.exists(self.part_path)
+        )
+        self._done = set(state.get("done", [])) if same_download else set()
+        if not same_download:
+            self._remove(self.part_path)
+    
+    def _save_state(self):
+        state = {"url": self.url, "size": self.total_size, "chunk_size": self.chunk_size, "done": sorted(self._done)}
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.state_path)
+    
+    def _progress(self, n_bytes):
+        with self._lock:
+            self.downloaded += n_bytes
+            now = time.monotonic()
+            if now - self._last_report < 0.5 and self.downloaded != self.total_size:
+                return
+            self._last_report = now
+        downloaded_mb = self.downloaded / (1024 * 1024)
+        if self.total_size > 0:
+            percent = self.downloaded * 100.0 / self.total_size
+            total_mb = self.total_size / (1024 * 1024)
+            print(f"\rProgress: {percent:.1f}% ({downloaded_mb:.1f}/{total_mb:.1f} MB)", end='', flush=True)
+        else:
+            print(f"\rProgress: {downloaded_mb:.1f} MB", end='', flush=True)
     
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_SIZE), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def published_sha256(url):
+    """
+    SHA-256 of a file hosted on Hugging Face, from the repository's Git LFS metadata
+    None for other URLs or files not stored in LFS; raises DownloadError when the lookup fails.
+    """
+    match = HF_FILE_PATTERN.match(url)
+    if not match:
+        return None
+    host, repo, revision, path = match.groups()
+    folder, _, _ = path.rpartition("/")
+    api_url = f"{host}/api/models/{repo}/tree/{revision}" + (f"/{folder}" if folder else "")
     try:
-        urllib.request.urlretrieve(url, filepath, reporthook=report_progress)
-        print("\n")  # New line after progress
-        return True
-    except Exception as e:
-        print(f"\n✗ Download failed: {e}")
-        return False
+        with urllib.request.urlopen(api_url, timeout=30) as response:
+            files = json.load(response)
+    except (OSError, ValueError) as e:
+        raise DownloadError(f"Could not look up the SHA-256 of {path}: {e}")
+    for entry in files:
+        if entry.get("path") == path and entry.get("lfs"):
+            return entry["lfs"].get("oid")
+    return None
 
 def create_env_file(model_filename):
     """Create .env file with model path"""
@@ -87,12 +316,22 @@ MODEL_PATH=models/{model_filename}
     
     print(f"✓ Created .env file: {env_path}")
 
-def main():
-    print("=" * 60)
-    print("SleepyHead - Model Downloader")
-    print("=" * 60)
-    
-    # Show available models
+def parse_args():
+    parser = argparse.ArgumentParser(description="Download a GGUF model for SleepyHead")
+    parser.add_argument("--model", choices=list(MODELS), help="Model to download (default: ask)")
+    parser.add_argument("--yes", "-y", action="store_true",
+                        help="Do not ask: keep an existing model file, resume or start the download")
+    parser.add_argument("--force", action="store_true", help="Download again even if the model file exists")
+    parser.add_argument("--connections", type=int, default=CONNECTIONS, help="Parallel connections")
+    parser.add_argument("--sha256", help="Expected SHA-256 of the file (default: MODELS, else the one Hugging Face publishes)")
+    parser.add_argument("--allow-unverified", action="store_true",
+                        help="Download even when no SHA-256 can be found for the file")
+    parser.add_argument("--url", help="Download from this URL instead of the model's (e.g. a mirror)")
+    parser.add_argument("--models-dir", default=str(Path(__file__).parent / "models"), help="Where to save the model")
+    return parser.parse_args()
+
+def choose_model():
+    """Ask which model to download"""
     print("\nAvailable models:\n")
     for i, (key, model) in enumerate(MODELS.items(), 1):
         print(f"{i}. {model['name']}")
@@ -100,85 +339,103 @@ def main():
         print(f"   Description: {model['description']}")
         print()
     
-    # Get user choice
     print("Recommended: Option 1 (TinyLlama) - Best balance of speed and quality")
-    choice = input("\nEnter your choice (1-3) [default: 1]: ").strip() or "1"
+    choice = input(f"\nEnter your choice (1-{len(MODELS)}) [default: 1]: ").strip() or "1"
     
     try:
         choice_idx = int(choice) - 1
-        model_key = list(MODELS.keys())[choice_idx]
-        selected_model = MODELS[model_key]
+        return list(MODELS.keys())[choice_idx]
     except (ValueError, IndexError):
         print("Invalid choice. Using TinyLlama (default).")
-        selected_model = MODELS["tinyllama"]
+        return "tinyllama"
+
+def main():
+    args = parse_args()
+    print("=" * 60)
+    print("SleepyHead - Model Downloader")
+    print("=" * 60)
     
+    model_key = args.model or choose_model()
+    selected_model = MODELS[model_key]
     print(f"\n✓ Selected: {selected_model['name']}")
     
     # Create models directory
-    models_dir = Path(__file__).parent / "models"
-    models_dir.mkdir(exist_ok=True)
+    models_dir = Path(args.models_dir)
+    models_dir.mkdir(parents=True, exist_ok=True)
     print(f"✓ Models directory: {models_dir}")
     
     # Check if model already exists
     model_path = models_dir / selected_model['filename']
-    if model_path.exists():
+    if model_path.exists() and not args.force:
         print(f"\n⚠ Model already exists: {model_path}")
-        overwrite = input("Do you want to re-download? (y/N): ").strip().lower()
+        overwrite = 'n' if args.yes else input("Do you want to re-download? (y/N): ").strip().lower()
         if overwrite != 'y':
             print("Using existing model.")
             create_env_file(selected_model['filename'])
             return
     
+    expected_sha256 = args.sha256 or selected_model.get('sha256')
+    if not expected_sha256:
+        # Looked up at the model's own URL, so files from a --url mirror are checked too
+        try:
+            expected_sha256 = published_sha256(selected_model['url'])
+        except DownloadError as e:
+            print(f"\n⚠ {e}")
+    if not expected_sha256:
+        print(f"\n⚠ No SHA-256 found for {selected_model['filename']}, so the download cannot be verified.")
+        if not args.allow_unverified:
+            print("Pass --sha256 with the hash shown on the file's Hugging Face page,")
+            print("or --allow-unverified to download it anyway.")
+            sys.exit(1)
+    
+    download = ChunkedDownload(
+        args.url or selected_model['url'],
+        model_path,
+        expected_sha256=expected_sha256,
+        connections=args.connections,
+        allow_unverified=args.allow_unverified
+    )
+    if os.path.exists(download.part_path) and not args.yes:
+        resume = input("A partial download exists. Resume it? (Y/n): ").strip().lower()
+        if resume == 'n':
+            download.discard()
+    
     # Download model
     try:
         print(f"\nDownloading {selected_model['name']}...")
         print(f"Size: {selected_model['size']}")
         
-        success = download_file_simple(selected_model['url'], str(model_path))
+        digest = download.run()
         
-        if not success:
-            print("\n✗ Error: Download failed")
-            if model_path.exists():
-                model_path.unlink()
-            sys.exit(1)
+        size_mb = model_path.stat().st_size / (1024 * 1024)
+        print(f"✓ Model downloaded successfully!")
+        print(f"✓ File size: {size_mb:.2f} MB")
+        print(f"✓ SHA-256: {digest}" + ("" if download.expected_sha256 else " (not verified, no known hash)"))
+        print(f"✓ Location: {model_path}")
         
-        # Verify download
-        if model_path.exists() and model_path.stat().st_size > 0:
-            size_mb = model_path.stat().st_size / (1024 * 1024)
-            print(f"✓ Model downloaded successfully!")
-            print(f"✓ File size: {size_mb:.2f} MB")
-            print(f"✓ Location: {model_path}")
-            
-            # Create .env file
-            create_env_file(selected_model['filename'])
-            
-            print("\n" + "=" * 60)
-            print("SUCCESS! Your model is ready to use.")
-            print("=" * 60)
-            print("\nNext steps:")
-            print("1. Make sure you have all dependencies installed:")
-            print("   pip install -r requirements.txt")
-            print("\n2. Start the backend server:")
-            print("   python server.py")
-            print("\n3. Start the frontend:")
-            print("   npm run dev")
-            print("\n" + "=" * 60)
-        else:
-            print("\n✗ Error: Download failed or file is empty")
-            sys.exit(1)
-            
+        # Create .env file
+        create_env_file(selected_model['filename'])
+        
+        print("\n" + "=" * 60)
+        print("SUCCESS! Your model is ready to use.")
+        print("=" * 60)
+        print("\nNext steps:")
+        print("1. Make sure you have all dependencies installed:")
+        print("   pip install -r requirements.txt")
+        print("\n2. Start the backend server:")
+        print("   python server.py")
+        print("\n3. Start the frontend:")
+        print("   npm run dev")
+        print("\n" + "=" * 60)
+    
     except KeyboardInterrupt:
-        print("\n\nDownload cancelled by user.")
-        if model_path.exists():
-            model_path.unlink()
+        print("\n\nDownload cancelled by user. Run the script again to resume.")
         sys.exit(1)
     except Exception as e:
         print(f"\n✗ Error downloading model: {e}")
-        import traceback
-        traceback.print_exc()
-        if model_path.exists():
-            model_path.unlink()
+        if os.path.exists(download.part_path):
+            print("Run the script again to resume the download.")
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
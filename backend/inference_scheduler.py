@@ -0,0 +1,209 @@
+import queue
+import threading
+import time
+
+class SchedulerError(Exception):
+    """Base class for errors raised by the inference scheduler"""
+
+class QueueFullError(SchedulerError):
+    """Raised when the request queue is full; retry_after is a hint in seconds"""
+    
+    def __init__(self, retry_after):
+        super().__init__("Server is busy, please retry shortly")
+        self.retry_after = retry_after
+
+class DeadlineExceededError(SchedulerError):
+    """Raised when a job did not finish before its deadline"""
+    
+    def __init__(self):
+        super().__init__("Request timed out waiting for the model")
+
+class JobCancelledError(SchedulerError):
+    """Raised when waiting on a job that was cancelled"""
+    
+    def __init__(self):
+        super().__init__("Request was cancelled")
+
+_END_OF_JOB = object()
+
+class InferenceJob:
+    """
+    One queued unit of work
+    `work` is called with a worker's LLMHandler and must return an iterator of
+    events; the worker checks for cancellation and the deadline between events
+    """
+    
+    def __init__(self, work, deadline):
+        self.work = work
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self._events = queue.Queue()
+        self._cancelled = threading.Event()
+    
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+    
+    def cancel(self):
+        """Ask the worker to stop this job at the next event"""
+        self._cancelled.set()
+    
+    def expired(self):
+        return time.monotonic() >= self.deadline
+    
+    def events(self):
+        """
+        Iterate over the job's events as the worker produces them
+        Closing the iterator early (e.g. a disconnected client) cancels the job
+        """
+        finished = False
+        try:
+            while True:
+                remaining = self.deadline - time.monotonic()
+                try:
+                    item = self._events.get(timeout=max(remaining, 0))
+                except queue.Empty:
+                    raise DeadlineExceededError()
+                
+                if item is _END_OF_JOB:
+                    finished = True
+                    return
+                if isinstance(item, BaseException):
+                    finished = True
+                    raise item
+                yield item
+        finally:
+            if not finished:
+                self.cancel()
+    
+    def result(self):
+        """Wait for the job to finish and return its last event"""
+        last_event = None
+        for event in self.events():
+            last_event = event
+        return last_event
+    
+    def _put(self, item):
+        self._events.put(item)
+
+class InferenceScheduler:
+    """
+    Runs LLM work on a fixed pool of workers
+    Each worker thread owns its own LLMHandler (llama.cpp contexts are not safe
+    to share between threads); with mmap the GGUF weights are loaded once by
+    the OS and shared between the contexts.
+    """
+    
+    def __init__(self, handler_factory, num_workers=1, max_queue_size=16, request_timeout=60.0):
+        self.num_workers = num_workers
+        self.request_timeout = request_timeout
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._avg_job_seconds = 2.0
+        self._active_jobs = 0
+        self._lock = threading.Lock()
+        
+        self.handlers = [handler_factory() for _ in range(num_workers)]
+        self._workers = []
+        for index, handler in enumerate(self.handlers):
+            worker = threading.Thread(
+                target=self._worker_loop,
+                args=(handler,),
+                name=f"llm-worker-{index}",
+                daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+    
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+    
+    @property
+    def active_jobs(self):
+        return self._active_jobs
+    
+    def retry_after(self):
+        """Rough number of seconds until a queue slot frees up"""
+        backlog = self._queue.qsize() + self._active_jobs
+        return max(1, int(self._avg_job_seconds * backlog / self.num_workers))
+    
+    def submit(self, work, timeout=None):
+        """
+        Queue work for the next free worker
+        Raises QueueFullError instead of blocking when the queue is full
+        """
+        if timeout is None:
+            timeout = self.request_timeout
+        else:
+            timeout = min(float(timeout), self.request_timeout)
+        
+        job = InferenceJob(work, deadline=time.monotonic() + timeout)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise QueueFullError(self.retry_after())
+        return job
+    
+    def drain(self, timeout=None):
+        """
+        Wait until the queue is empty and no job is running
+        Returns False if that did not happen within timeout seconds
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.qsize() or self._active_jobs:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+    
+    def shutdown(self):
+        """Stop the workers once they finish their current job"""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+    
+    def _worker_loop(self, handler):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            
+            # Skip work nobody is waiting for any more
+            if job.cancelled:
+                job._put(JobCancelledError())
+                continue
+            if job.expired():
+                job._put(DeadlineExceededError())
+                continue
+            
+            with self._lock:
+                self._active_jobs += 1
+            started = time.monotonic()
+            try:
+                self._run_job(job, handler)
+            finally:
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    self._active_jobs -= 1
+                    self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * elapsed
+    
+    def _run_job(self, job, handler):
+        events = None
+        try:
+            events = job.work(handler)
+            for event in events:
+                if job.cancelled:
+                    job._put(JobCancelledError())
+                    return
+                if job.expired():
+                    job._put(DeadlineExceededError())
+                    return
+                job._put(event)
+            job._put(_END_OF_JOB)
+        except Exception as e:
+            job._put(e)
+        finally:
+            # Closing the generator stops llama.cpp from decoding further tokens
+            if events is not None and hasattr(events, 'close'):
+                events.close()
@@ -0,0 +1,140 @@
+from collections import OrderedDict
+import ctypes
+import threading
+
+import llama_cpp
+from llama_cpp import LlamaState
+import numpy as np
+
+from metrics import CACHE_LOOKUPS
+
+def common_prefix_length(a, b):
+    """Number of leading tokens two token sequences share"""
+    n = min(len(a), len(b))
+    if n == 0:
+        return 0
+    mismatches = np.flatnonzero(np.asarray(a[:n]) != np.asarray(b[:n]))
+    return int(mismatches[0]) if len(mismatches) else n
+
+class PromptStateCache:
+    """
+    KV-cache snapshots for prompt prefix reuse
+    Keeps the evaluated state of the fixed system prompts plus the last state
+    of each chat session (LRU, bounded by max_bytes). Before a generation the
+    snapshot sharing the longest prefix with the new prompt is restored, so
+    llama.cpp only has to evaluate the tokens after that prefix.
+    """
+    
+    def __init__(self, llm, max_bytes=512 * 1024 * 1024):
+        self.llm = llm
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self._system_states = {}
+        self._sessions = OrderedDict()
+        self._session_bytes = 0
+        self._lock = threading.Lock()
+    
+    def tokenize(self, prompt):
+        """Tokenize a ChatML prompt the same way Llama.__call__ does"""
+        return self.llm.tokenize(prompt.encode('utf-8'), add_bos=True, special=True)
+    
+    def add_system_prompt(self, key, prompt):
+        """Evaluate a fixed prompt prefix once and keep its KV state"""
+        tokens = self.tokenize(prompt)
+        self.llm.reset()
+        self.llm.eval(tokens)
+        self._system_states[key] = self._snapshot()
+    
+    def restore(self, session_id, prompt_tokens):
+        """
+        Load the snapshot that shares the longest prefix with prompt_tokens
+        Nothing is loaded when the live context already matches better.
+        Returns the number of prompt tokens that will not be re-evaluated.
+        """
+        best_length = common_prefix_length(self.llm._input_ids, prompt_tokens)
+        best_state = None
+        
+        with self._lock:
+            candidates = list(self._system_states.values())
+            if session_id in self._sessions:
+                self._sessions.move_to_end(session_id)
+                candidates.append(self._sessions[session_id])
+        
+        for tokens, state in candidates:
+            length = common_prefix_length(tokens, prompt_tokens)
+            if length > best_length:
+                best_length, best_state = length, state
+        
+        if best_state is not None:
+            self.llm.load_state(best_state)
+        
+        if best_length > 0:
+            self.hits += 1
+            self.reused_tokens += best_length
+            CACHE_LOOKUPS.inc(cache='prefix', result='hit')
+        else:
+            self.misses += 1
+            CACHE_LOOKUPS.inc(cache='prefix', result='miss')
+        return best_length
+    
+    def save(self, session_id):
+        """Snapshot the live context as the latest state of a session"""
+        if not session_id:
+            return
+        
+        tokens, state = self._snapshot()
+        size = self._state_bytes(state)
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            if session_id in self._sessions:
+                self._session_bytes -= self._state_bytes(self._sessions.pop(session_id)[1])
+            self._sessions[session_id] = (tokens, state)
+            self._session_bytes += size
+            
+            # Evict least recently used sessions until we are under budget
+            while self._session_bytes > self.max_bytes:
+                _, (_, evicted) = self._sessions.popitem(last=False)
+                self._session_bytes -= self._state_bytes(evicted)
+    
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "reused_tokens": self.reused_tokens,
+            "sessions": len(self._sessions),
+            "session_bytes": self._session_bytes
+        }
+    
+    def _snapshot(self):
+        """
+        Tokens and LlamaState of the live context
+        Built here instead of with Llama.save_state(), which first copies the
+        logits of every evaluated token (all n_tokens rows with logits_all, as
+        speculative decoding needs). Sampling happens inside llama.cpp, so the
+        saved logits are never read back; a single row (it broadcasts on load)
+        is enough.
+        """
+        llm = self.llm
+        size = llama_cpp.llama_state_get_size(llm._ctx.ctx)
+        buffer = (ctypes.c_uint8 * size)()
+        n_bytes = llama_cpp.llama_state_get_data(llm._ctx.ctx, buffer, size)
+        if n_bytes > size:
+            raise RuntimeError("Failed to copy llama state data")
+        
+        state = LlamaState(
+            input_ids=llm.input_ids.copy(),
+            scores=llm._scores[-1:, :].copy(),
+            n_tokens=llm.n_tokens,
+            llama_state=bytes(memoryview(buffer)[:n_bytes]),
+            llama_state_size=n_bytes,
+            seed=llm._seed
+        )
+        return state.input_ids[:state.n_tokens].copy(), state
+    
+    @staticmethod
+    def _state_bytes(state):
+        return state.llama_state_size + state.scores.nbytes + state.input_ids.nbytes
@@ -0,0 +1,65 @@
+import re
+
+# Common Hindi/Hinglish words in Latin script
+HINGLISH_WORDS = frozenset("""
+hai hain ho tha thi the ka ki ke ko kya kaise kyun abhi bohot bahut achha acha thik nahi nahin
+haan haa bhai yaar dost accha kuch koi matlab samajh pata kaisa kaisi aise waise apna mera tera
+uska sabse bilkul sahi galat tension chill bas aur lekin par toh to hua hui hue raha rahi rahe
+laga lagi lage mil mila mili mile dena diya diye lena liya liye dekh dekha dekhi dekhe sun suna
+suni sune kaam padh padha padhi jana gaya gayi gaye aana aaya aayi aaye karna kiya kiye hona
+hogaya hogayi hogaye aaj haal mujhe tujhe kyu kyunki bhi nhi hoon hun wala wali yeh woh kab kahan
+kaun thoda zyada ek chahiye
+""".split())
+
+# Words that are just as common in English; they only count once the text
+# has at least one unambiguous Hinglish word ("I went to the park" is English)
+AMBIGUOUS_WORDS = frozenset({"the", "to", "ho", "par", "sun", "mil", "mile", "bas", "hue", "tension", "chill"})
+
+# Latin words or runs of Devanagari (U+0900-U+097F)
+TOKEN_PATTERN = re.compile(r"[a-z]+|[\u0900-\u097f]+")
+
+class LanguageDetector:
+    """
+    Token-set language detection for English vs Hinglish
+    The text is split into Latin and Devanagari words in one regex pass and
+    each word is looked up in a frozenset. Devanagari words count as Hindi, so
+    mixed-script messages are scored on both scripts together.
+    """
+    
+    def __init__(self, threshold=0.2):
+        # Fraction of Hinglish words from which a message is treated as Hinglish
+        self.threshold = threshold
+    
+    def analyze(self, text):
+        """
+        Returns: dict with language, confidence (fraction of Hinglish words)
+        and the word counts it is based on
+        """
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        
+        hindi = 0
+        ambiguous = 0
+        devanagari = 0
+        for token in tokens:
+            if token in HINGLISH_WORDS:
+                if token in AMBIGUOUS_WORDS:
+                    ambiguous += 1
+                else:
+                    hindi += 1
+            elif token[0] >= '\u0900':
+                devanagari += 1
+        
+        hinglish_tokens = hindi + devanagari + (ambiguous if hindi or devanagari else 0)
+        confidence = hinglish_tokens / len(tokens) if tokens else 0.0
+        
+        return {
+            'language': 'hinglish' if hinglish_tokens and confidence >= self.threshold else 'english',
+            'confidence': confidence,
+            'hinglish_tokens': hinglish_tokens,
+            'devanagari_tokens': devanagari,
+            'tokens': len(tokens)
+        }
+    
+    def detect(self, text):
+        """Return 'hinglish' or 'english'"""
+        return self.analyze(text)['language']
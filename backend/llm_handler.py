@@ -1,174 +1,408 @@
-from llama_cpp import Llama
+from llama_cpp import Llama, StoppingCriteriaList
+from kv_cache import PromptStateCache
+from batch_engine import BatchEngine
+from speculative import SmallModelDraft
+from runtime_config import RuntimeConfig
+from chat_templates import get_chat_template
+from language_detector import LanguageDetector
+from output_filter import StreamFilter, reply_done_check
+from metrics import (
+    STAGE_SECONDS, PROMPT_TOKENS, PROMPT_TOKENS_EVALUATED, COMPLETION_TOKENS, TOKENS_PER_SECOND, debug_log
+)
+import codecs
 import os
-import re
+import time
+
+# Sampling settings shared by the blocking and streaming paths
+GENERATION_PARAMS = {
+    "max_tokens": 60,  # Reduced to prevent rambling
+    "temperature": 0.7,  # Lower for more focused responses
+    "top_p": 0.9,
+    "top_k": 30,  # Added to reduce randomness
+    "stop": ["user:", "User:", "\n\n", "assistant:"],  # plus the chat template's end-of-turn tokens
+    "echo": False,
+    "repeat_penalty": 1.2  # Higher to prevent loops
+}
+
+# End generation as soon as an AI/explanatory phrase starts; the reply is cut right before it
+STOP_AT_AI_PHRASE = True
+
+# System prompts by language and sentiment tone
+SYSTEM_PROMPTS = {
+    "hinglish": {
+        "very_positive": "Tu Sleepyhead hai, user ka dost. BAHUT IMPORTANT: Naturally baat kar, KABHI explain mat kar ki kya matlab hai, translation mat kar, teaching mat kar. Bilkul normal friend ki tarah. User khush hai toh match kar energy. Short and natural - 2-3 sentences max. Emojis use kar sakte ho.",
+        
+        "positive": "Tu Sleepyhead hai, bestfriend. User happy hai. CRITICAL: Natural baat kar jaise message kar rahe ho. NEVER explain words, NEVER translate, NEVER teach Hindi/English. Just respond casually. 2-3 sentences. Be chill.",
+        
+        "neutral": "Tu Sleepyhead hai, chill dost. SUPER IMPORTANT: Bilkul natural casual baat. NO explanations, NO translations, NO teaching. Just be a normal friend having a conversation. 2-3 sentences only.",
+        
+        "negative": "Tu Sleepyhead hai, caring dost. User upset hai. KEY RULE: Supportive bano BUT naturally - ZERO explanations, ZERO word meanings, ZERO teaching. Just be there as a friend. 2-3 genuine sentences.",
+        
+        "very_negative": "Tu Sleepyhead hai, bohot caring dost. User hurt hai. MUST FOLLOW: Show empathy naturally - NO explaining meanings, NO translations, NO formal stuff. Real friend ki tarah support karo. 2-3 heartfelt sentences."
+    },
+    "english": {
+        "very_positive": "You're Sleepyhead, user's friend. CRITICAL: Talk naturally like a real person texting. NEVER explain words, NEVER translate, NEVER be educational. User's happy so match the vibe! 2-3 casual sentences. Can use emojis.",
+        
+        "positive": "You're Sleepyhead, a bestfriend. User's feeling good. KEY RULE: Respond naturally like you're texting. NO explanations, NO teaching. Just be a chill friend. 2-3 sentences max.",
+        
+        "neutral": "You're Sleepyhead, a chill friend. IMPORTANT: Normal casual conversation only. ZERO explanations, ZERO definitions. Just chat like a regular person. 2-3 sentences.",
+        
+        "negative": "You're Sleepyhead, caring friend. User's going through something. MUST: Be supportive naturally - NO explaining, NO formal responses. Just be there like a real friend. 2-3 genuine sentences.",
+        
+        "very_negative": "You're Sleepyhead, really caring friend. User's really struggling. CRITICAL: Show genuine care - NO explanations, NO formality. Talk like a close friend who truly gets it. 2-3 heartfelt sentences."
+    }
+}
+
+# Fixed system message of every prompt - SIMPLIFIED for better control
+# The model's chat template wraps it (ChatML for OpenHermes)
+SYSTEM_MESSAGES = {
+    "hinglish": "You are Sleepyhead, a chill friend. Talk naturally in Hinglish. NO explanations, NO teaching. Just chat like texting a friend. Keep responses SHORT - maximum 2 sentences. Be casual and genuine.",
+    "english": "You are Sleepyhead, a chill friend. Talk naturally and casually. NO explanations, NO formality. Just chat like texting a friend. Keep responses SHORT - maximum 2 sentences. Be genuine."
+}
+
+# Shared by every handler; detection is stateless
+language_detector = LanguageDetector()
 
 class LLMHandler:
-    def __init__(self, model_path):
+    def __init__(self, model_path, kv_cache_bytes=512 * 1024 * 1024, batch_slots=0,
+                 runtime=None, history_tokens=0,
+                 chat_template='chatml', n_ctx=4096, model_key=None, draft_model_path=None, draft_tokens=6):
         """
         Initialize the GGUF model
+        kv_cache_bytes bounds the memory used for per-session KV snapshots
+        batch_slots > 0 decodes concurrent requests together in one batched context;
+        the handler can then be shared by several worker threads
+        runtime holds the llama.cpp threads, batch size, GPU layers and mmap/mlock
+        settings (runtime_config.RuntimeConfig; detected for this machine if None)
+        history_tokens caps the conversation history in a prompt (0 = whatever fits)
+        chat_template names the prompt format (chat_templates.CHAT_TEMPLATES) and
+        n_ctx the context size of the model; model_key keeps this model's token
+        ids apart from other models' in the per-turn token cache
+        draft_model_path enables speculative decoding with that (small) model
+        proposing draft_tokens tokens at a time; not used with batching
         """
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"Model file not found: {model_path}")
         
+        runtime = runtime or RuntimeConfig.detect()
+        if runtime.n_ctx:
+            n_ctx = min(n_ctx, runtime.n_ctx)
+        self.chat_template = get_chat_template(chat_template)
+        self.model_key = model_key or model_path
+        self.generation_params = dict(GENERATION_PARAMS, stop=self.chat_template.stop + GENERATION_PARAMS['stop'])
+        
+        draft_model = None
+        if draft_model_path and not os.path.exists(draft_model_path):
+            print(f"WARNING: draft model not found, speculative decoding is off: {draft_model_path}")
+        elif draft_model_path and batch_slots == 0:
+            print(f"Loading draft model from {draft_model_path}...")
+            draft_model = SmallModelDraft(
+                draft_model_path, num_pred_tokens=draft_tokens, n_ctx=n_ctx, **runtime.llama_params()
+            )
+        elif draft_model_path:
+            print("WARNING: speculative decoding is not supported with batching, draft model not loaded")
+        
         print(f"Loading model from {model_path}...")
         self.llm = Llama(
             model_path=model_path,
-            n_ctx=4096,  # Larger context for OpenHermes
-            n_threads=6,  # More threads for 7B model
-            n_gpu_layers=0,  # Set to > 0 if you have GPU support
+            # With batching this context is only used for tokenizing
+            n_ctx=n_ctx if batch_slots == 0 else 512,
+            **runtime.llama_params(),
+            # Verifying a draft needs the logits of every drafted position
+            logits_all=draft_model is not None,
+            draft_model=draft_model,
             verbose=False
         )
-        print("Model loaded successfully!")
+        if draft_model is not None:
+            draft_model.set_target(self.llm)
+        print(f"Model loaded successfully! ({runtime.n_threads} threads, {runtime.n_threads_batch} for prompts, "
+              f"batch {runtime.n_batch}, settings from {runtime.source})")
+        
+        # Token budget of one prompt plus its reply
+        self.n_ctx = n_ctx if batch_slots == 0 else min(n_ctx, 2048)
+        self.history_tokens = history_tokens
+        self._system_tokens = {
+            language: self._tokenize(self.system_block(language), add_bos=True)
+            for language in ('english', 'hinglish')
+        }
+        
+        self.batch_engine = None
+        self.prompt_cache = None
+        if batch_slots > 0:
+            self.batch_engine = BatchEngine(
+                self.llm, n_slots=batch_slots, n_ctx_per_slot=self.n_ctx, n_batch=runtime.n_batch,
+                n_threads=runtime.n_threads, n_threads_batch=runtime.n_threads_batch
+            )
+            print(f"Batched generation enabled with {batch_slots} slots")
+        else:
+            # Evaluate both system prompts once so every request starts from a warm prefix
+            self.prompt_cache = PromptStateCache(self.llm, max_bytes=kv_cache_bytes)
+            for language in ('english', 'hinglish'):
+                self.prompt_cache.add_system_prompt(language, self.system_block(language))
     
-    def detect_language(self, text):
+    @staticmethod
+    def detect_language(text):
         """Detect if user is using Hinglish or English"""
-        # Common Hindi/Hinglish words in Latin script
-        hinglish_patterns = [
-            r'\b(hai|hain|ho|tha|thi|the|ka|ki|ke|ko|kya|kaise|kyun|abhi|bohot|bahut|achha|acha|thik|nahi|nahin|haan|haa|bhai|yaar|dost|accha|kuch|koi|matlab|samajh|pata|kaisa|kaisi|aise|waise|apna|mera|tera|uska|sabse|bilkul|sahi|galat|tension|chill|bas|aur|lekin|par|toh|to|hua|hui|hue|raha|rahi|rahe|laga|lagi|lage|mil|mila|mili|mile|dena|diya|diye|lena|liya|liye|dekh|dekha|dekhi|dekhe|sun|suna|suni|sune|kaam|kaam|padh|padha|padhi|jana|gaya|gayi|gaye|aana|aaya|aayi|aaye|karna|kiya|kiye|hona|hogaya|hogayi|hogaye)\b',
-            r'[क-ह]'  # Devanagari characters
-        ]
-        
-        for pattern in hinglish_patterns:
-            if re.search(pattern, text.lower()):
-                return 'hinglish'
-        return 'english'
+        with STAGE_SECONDS.time(stage='language_detect'):
+            return language_detector.detect(text)
     
     def get_system_prompt(self, tone, language='english'):
         """
         Get system prompt based on sentiment tone and language
         """
-        if language == 'hinglish':
-            prompts = {
-                "very_positive": "Tu Sleepyhead hai, user ka dost. BAHUT IMPORTANT: Naturally baat kar, KABHI explain mat kar ki kya matlab hai, translation mat kar, teaching mat kar. Bilkul normal friend ki tarah. User khush hai toh match kar energy. Short and natural - 2-3 sentences max. Emojis use kar sakte ho.",
-                
-                "positive": "Tu Sleepyhead hai, bestfriend. User happy hai. CRITICAL: Natural baat kar jaise message kar rahe ho. NEVER explain words, NEVER translate, NEVER teach Hindi/English. Just respond casually. 2-3 sentences. Be chill.",
-                
-                "neutral": "Tu Sleepyhead hai, chill dost. SUPER IMPORTANT: Bilkul natural casual baat. NO explanations, NO translations, NO teaching. Just be a normal friend having a conversation. 2-3 sentences only.",
-                
-                "negative": "Tu Sleepyhead hai, caring dost. User upset hai. KEY RULE: Supportive bano BUT naturally - ZERO explanations, ZERO word meanings, ZERO teaching. Just be there as a friend. 2-3 genuine sentences.",
-                
-                "very_negative": "Tu Sleepyhead hai, bohot caring dost. User hurt hai. MUST FOLLOW: Show empathy naturally - NO explaining meanings, NO translations, NO formal stuff. Real friend ki tarah support karo. 2-3 heartfelt sentences."
-            }
-        else:
-            prompts = {
-                "very_positive": "You're Sleepyhead, user's friend. CRITICAL: Talk naturally like a real person texting. NEVER explain words, NEVER translate, NEVER be educational. User's happy so match the vibe! 2-3 casual sentences. Can use emojis.",
-                
-                "positive": "You're Sleepyhead, a bestfriend. User's feeling good. KEY RULE: Respond naturally like you're texting. NO explanations, NO teaching. Just be a chill friend. 2-3 sentences max.",
-                
-                "neutral": "You're Sleepyhead, a chill friend. IMPORTANT: Normal casual conversation only. ZERO explanations, ZERO definitions. Just chat like a regular person. 2-3 sentences.",
-                
-                "negative": "You're Sleepyhead, caring friend. User's going through something. MUST: Be supportive naturally - NO explaining, NO formal responses. Just be there like a real friend. 2-3 genuine sentences.",
-                
-                "very_negative": "You're Sleepyhead, really caring friend. User's really struggling. CRITICAL: Show genuine care - NO explanations, NO formality. Talk like a close friend who truly gets it. 2-3 heartfelt sentences."
-            }
-        
+        prompts = SYSTEM_PROMPTS['hinglish' if language == 'hinglish' else 'english']
         return prompts.get(tone, prompts["neutral"])
     
-    def generate_response(self, user_message, tone, conversation_history=None):
+    def system_block(self, language):
         """
-        Generate a response based on user message and sentiment tone
-        Uses OpenHermes chat format with language detection
+        Fixed system part of the prompt; every prompt for a language starts with it
+        """
+        return self.chat_template.system_block(SYSTEM_MESSAGES['hinglish' if language == 'hinglish' else 'english'])
+    
+    def build_prompt(self, user_message, language, history=None):
         """
-        # Detect language
-        language = self.detect_language(user_message)
-        print(f"Detected language: {language.upper()}")
+        Build the prompt for a user message in the model's chat template
+        history: the session turns to include (see build_prompt_tokens)
+        """
+        prompt = self.system_block(language)
+        for turn in history or []:
+            prompt += self.chat_template.turn(turn.role, turn.text)
         
-        system_instruction = self.get_system_prompt(tone, language)
+        # Add current message
+        prompt += self.chat_template.message('user', user_message) + self.chat_template.assistant_prefix
         
-        # OpenHermes/Mistral chat format - SIMPLIFIED for better control
-        if language == 'hinglish':
-            prompt = f"""<|im_start|>system
-You are Sleepyhead, a chill friend. Talk naturally in Hinglish. NO explanations, NO teaching. Just chat like texting a friend. Keep responses SHORT - maximum 2 sentences. Be casual and genuine.<|im_end|>
-"""
-        else:
-            prompt = f"""<|im_start|>system
-You are Sleepyhead, a chill friend. Talk naturally and casually. NO explanations, NO formality. Just chat like texting a friend. Keep responses SHORT - maximum 2 sentences. Be genuine.<|im_end|>
-"""
-        
-        # Only add last 2 messages for context (prevent confusion)
-        if conversation_history and len(conversation_history) > 0:
-            recent_history = conversation_history[-4:]  # Last 2 exchanges
-            for msg in recent_history:
-                if msg['type'] == 'user':
-                    prompt += f"<|im_start|>user\n{msg['text']}<|im_end|>\n"
-                elif msg['type'] == 'bot':
-                    prompt += f"<|im_start|>assistant\n{msg['text']}<|im_end|>\n"
+        return prompt
+    
+    def build_prompt_tokens(self, user_message, language, session=None):
+        """
+        Token ids of the prompt build_prompt would produce
+        History turns are tokenized once and cached on the session; the latest
+        turns that fit in the context window next to the reply are included.
+        Returns: (prompt tokens, history turns included)
+        """
+        language = 'hinglish' if language == 'hinglish' else 'english'
+        system_tokens = self._system_tokens[language]
+        message_tokens = self._tokenize(
+            self.chat_template.message('user', user_message) + self.chat_template.assistant_prefix
+        )
         
-        # Add current message
-        prompt += f"<|im_start|>user\n{user_message}<|im_end|>\n<|im_start|>assistant\n"
+        budget = self.n_ctx - GENERATION_PARAMS['max_tokens'] - len(system_tokens) - len(message_tokens)
+        if self.history_tokens:
+            budget = min(budget, self.history_tokens)
+        history = self._history_window(session, budget) if session is not None else []
+        
+        prompt_tokens = list(system_tokens)
+        for turn in history:
+            prompt_tokens += self._turn_tokens(turn)
+        prompt_tokens += message_tokens
+        return prompt_tokens, history
+    
+    def generate_response(self, user_message, tone, session=None, language=None):
+        """
+        Generate a response based on user message and sentiment tone
+        Uses the model's chat template; language is detected unless the caller already did
+        session (session_store.Session) supplies the history; its id also lets
+        follow-up turns reuse the KV state of the previous turn
+        """
+        if language is None:
+            language = self.detect_language(user_message)
+        log_details = debug_log.sampled()
         
-        print(f"\n--- PROMPT SENT TO MODEL ---")
-        print(prompt)
-        print(f"--- END PROMPT ---\n")
+        with STAGE_SECONDS.time(stage='prompt_build'):
+            prompt_tokens, history = self.build_prompt_tokens(user_message, language, session)
+        
+        if log_details:
+            debug_log.log("PROMPT SENT TO MODEL", self.build_prompt(user_message, language, history))
         
         # Generate response with tighter controls
-        output = self.llm(
-            prompt,
-            max_tokens=60,  # Reduced to prevent rambling
-            temperature=0.7,  # Lower for more focused responses
-            top_p=0.9,
-            top_k=30,  # Added to reduce randomness
-            stop=["<|im_end|>", "<|im_start|>", "user:", "User:", "\n\n", "assistant:"],
-            echo=False,
-            repeat_penalty=1.2  # Higher to prevent loops
+        session_id = session.session_id if session is not None else None
+        self._restore_prefix(prompt_tokens, session_id)
+        output = "".join(self._timed_text(self._complete(prompt_tokens, stream=True)))
+        self._save_prompt_state(session_id)
+        
+        if log_details:
+            debug_log.log("RAW MODEL OUTPUT", output)
+        
+        # Same cleanup as the streaming path, including a cut before an AI phrase
+        with STAGE_SECONDS.time(stage='post_process'):
+            stream_filter = StreamFilter(stop_at_ai_phrase=STOP_AT_AI_PHRASE)
+            stream_filter.feed(output)
+            return stream_filter.finish(tone, language)[1]
+    
+    def generate_response_stream(self, user_message, tone, session=None, language=None):
+        """
+        Streaming version of generate_response
+        Yields {'type': 'token', 'text': ...} events as soon as text is safe to show,
+        then a final {'type': 'done', 'response': ...} event with the cleaned reply.
+        The final response can differ from the streamed text when the fallback kicks in.
+        """
+        if language is None:
+            language = self.detect_language(user_message)
+        log_details = debug_log.sampled()
+        
+        with STAGE_SECONDS.time(stage='prompt_build'):
+            prompt_tokens, history = self.build_prompt_tokens(user_message, language, session)
+        
+        if log_details:
+            debug_log.log("PROMPT SENT TO MODEL", self.build_prompt(user_message, language, history))
+        
+        session_id = session.session_id if session is not None else None
+        self._restore_prefix(prompt_tokens, session_id)
+        
+        stream_filter = StreamFilter(stop_at_ai_phrase=STOP_AT_AI_PHRASE)
+        filter_seconds = 0.0
+        texts = self._timed_text(self._complete(prompt_tokens, stream=True))
+        try:
+            for text in texts:
+                started = time.perf_counter()
+                delta = stream_filter.feed(text)
+                filter_seconds += time.perf_counter() - started
+                if delta:
+                    yield {'type': 'token', 'text': delta}
+                # Anything generated after this point would be cut off anyway
+                if stream_filter.complete:
+                    break
+        finally:
+            texts.close()
+        
+        self._save_prompt_state(session_id)
+        
+        if log_details:
+            debug_log.log("RAW MODEL OUTPUT", stream_filter.raw_text)
+        
+        started = time.perf_counter()
+        delta, response_text = stream_filter.finish(tone, language)
+        STAGE_SECONDS.observe(filter_seconds + time.perf_counter() - started, stage='post_process')
+        if delta:
+            yield {'type': 'token', 'text': delta}
+        yield {
+            'type': 'done',
+            'response': response_text,
+            'replaced': response_text != stream_filter.text.strip()
+        }
+    
+    def warm_up(self):
+        """Generate a single token so the first real request does not pay for page faults"""
+        prompt_tokens, _ = self.build_prompt_tokens("hi", 'english')
+        self._restore_prefix(prompt_tokens, None)
+        for _ in self._complete(prompt_tokens, stream=True):
+            break
+    
+    def _tokenize(self, text, add_bos=False):
+        return self.llm.tokenize(text.encode('utf-8'), add_bos=add_bos, special=True)
+    
+    def _turn_tokens(self, turn):
+        """Tokens of one history turn, tokenized once per model and cached on the turn"""
+        tokens = turn.tokens.get(self.model_key)
+        if tokens is None:
+            tokens = turn.tokens[self.model_key] = self._tokenize(self.chat_template.turn(turn.role, turn.text))
+        return tokens
+    
+    def _history_window(self, session, budget):
+        """
+        Latest turns of a session that fit in budget tokens
+        The window start only moves forward, and then by half the budget at
+        once, so consecutive prompts of a session keep sharing a long prefix
+        with its KV snapshot instead of shifting by one turn every request
+        """
+        turns = session.turns
+        start = min(session.context_start, len(turns))
+        total = sum(len(self._turn_tokens(turn)) for turn in turns[start:])
+        
+        if total > budget:
+            while start < len(turns) and total > budget // 2:
+                total -= len(self._turn_tokens(turns[start]))
+                start += 1
+            session.context_start = start
+        
+        return turns[start:]
+    
+    def _restore_prefix(self, prompt_tokens, session_id):
+        """
+        Restore the cached KV prefix that best matches the prompt
+        llama.cpp then only evaluates the tokens after the reused prefix
+        """
+        PROMPT_TOKENS.inc(len(prompt_tokens))
+        # The batch engine counts its own slot reuse
+        if self.batch_engine is None:
+            reused = self.prompt_cache.restore(session_id, prompt_tokens)
+            PROMPT_TOKENS_EVALUATED.inc(len(prompt_tokens) - reused)
+    
+    def _complete(self, prompt_tokens, stream=False):
+        """
+        Run the model on a tokenized prompt
+        Decoding stops as soon as more tokens could not change the cleaned reply
+        Goes through the batch engine when batching is enabled
+        """
+        if self.batch_engine is None:
+            stopping_criteria = StoppingCriteriaList([self._reply_done_criterion(prompt_tokens)])
+            return self.llm(prompt_tokens, stream=stream, stopping_criteria=stopping_criteria, **self.generation_params)
+        
+        chunks = self.batch_engine.submit(
+            prompt_tokens, should_stop=reply_done_check(STOP_AT_AI_PHRASE), **self.generation_params
         )
+        if stream:
+            return chunks
+        return {'choices': [{'text': "".join(chunk['choices'][0]['text'] for chunk in chunks)}]}
+    
+    @staticmethod
+    def _timed_text(chunks):
+        """
+        Text of each completion chunk
+        Time until the first chunk counts as prompt eval, the rest as decode;
+        only time spent waiting on the model is measured. Each chunk is about
+        one token.
+        """
+        prompt_eval_seconds = None
+        decode_seconds = 0.0
+        n_chunks = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                chunk = next(chunks, None)
+                elapsed = time.perf_counter() - started
+                if prompt_eval_seconds is None:
+                    prompt_eval_seconds = elapsed
+                    STAGE_SECONDS.observe(elapsed, stage='prompt_eval')
+                else:
+                    decode_seconds += elapsed
+                if chunk is None:
+                    return
+                n_chunks += 1
+                yield chunk['choices'][0]['text']
+        finally:
+            chunks.close()
+            if prompt_eval_seconds is not None:
+                STAGE_SECONDS.observe(decode_seconds, stage='decode')
+                COMPLETION_TOKENS.inc(n_chunks)
+                if n_chunks > 1 and decode_seconds > 0:
+                    TOKENS_PER_SECOND.observe((n_chunks - 1) / decode_seconds)
+    
+    def _reply_done_criterion(self, prompt_tokens):
+        """
+        llama.cpp stopping criterion: True once the sentence limit, a newline or
+        an AI phrase ended the reply. One StreamFilter per generation is fed the
+        text of the tokens added since the previous call.
+        """
+        n_prompt = len(prompt_tokens)
+        stream_filter = decoder = None
+        seen = n_prompt
         
-        print(f"--- RAW MODEL OUTPUT ---")
-        print(output)
-        print(f"--- END OUTPUT ---\n")
-        
-        response_text = output['choices'][0]['text'].strip()
-        
-        # Clean up formatting
-        response_text = response_text.replace("<|im_end|>", "").replace("<|im_start|>", "").strip()
-        response_text = response_text.split('\n')[0]  # Only take first line
-        
-        # Remove AI/explanatory patterns
-        ai_patterns = [
-            r"As an AI[^.!?]*[.!?]",
-            r"I(?:'m| am) an AI[^.!?]*[.!?]",
-            r"Aapne ye bola[^.!?]*[.!?]",
-            r"which means[^.!?]*[.!?]",
-            r"It seems like[^.!?]*[.!?]",
-            r"translation:[^.!?]*[.!?]",
-            r"means \"[^\"]*\"",
-            r"So feel free[^.!?]*[.!?]",
-        ]
-        
-        for pattern in ai_patterns:
-            response_text = re.sub(pattern, "", response_text, flags=re.IGNORECASE)
-        
-        response_text = response_text.strip()
-        
-        # Take only first sentence if too long
-        if '. ' in response_text:
-            sentences = response_text.split('. ')
-            # Take first 1-2 sentences max
-            response_text = '. '.join(sentences[:2])
-            if not response_text.endswith('.'):
-                response_text += '.'
-        
-        # If response is still problematic or too short, use fallback
-        if not response_text or len(response_text) < 5 or len(response_text) > 200:
-            print(f"WARNING: Model response problematic, using fallback")
-            
-            if language == 'hinglish':
-                fallback_responses = {
-                    "very_positive": "Arre wah bhai! 😊",
-                    "positive": "Nice yaar!",
-                    "neutral": "Haan bro, bol",
-                    "negative": "Yaar... kya hua?",
-                    "very_negative": "I'm here yaar 💙"
-                }
-            else:
-                fallback_responses = {
-                    "very_positive": "That's awesome! 😊",
-                    "positive": "Nice!",
-                    "neutral": "Yeah, what's up?",
-                    "negative": "Hey... what happened?",
-                    "very_negative": "I'm here for you 💙"
-                }
-            
-            response_text = fallback_responses.get(tone, "Tell me more")
-        
-        return response_text
\ No newline at end of file
+        def reply_done(input_ids, logits):
+            nonlocal stream_filter, decoder, seen
+            if stream_filter is None or len(input_ids) < seen:
+                stream_filter = StreamFilter(stop_at_ai_phrase=STOP_AT_AI_PHRASE)
+                # Characters split over several tokens come out once complete
+                decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+                seen = n_prompt
+            text = decoder.decode(self.llm.detokenize(input_ids[seen:].tolist()))
+            seen = len(input_ids)
+            stream_filter.feed(text)
+            return stream_filter.complete
+        
+        return reply_done
+    
+    def _save_prompt_state(self, session_id):
+        # The batch engine keeps prefixes in its own slots
+        if self.batch_engine is None:
+            self.prompt_cache.save(session_id)
@@ -0,0 +1,227 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; from a regex pass over one message up to a long generation
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 100, 200)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Base class; values are kept per label combination"""
+    
+    type_name = "untyped"
+    
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        lines += self._samples()
+        return lines
+    
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_label_text(self.label_names, key)} {_number(value)}" for key, value in items]
+
+class Counter(Metric):
+    type_name = "counter"
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+class Gauge(Metric):
+    """
+    Current value of something
+    With `function` the value is read when the metrics are rendered; it may
+    return a number or a {label values tuple: number} dict
+    """
+    
+    type_name = "gauge"
+    
+    def __init__(self, name, help_text, labels=(), function=None):
+        super().__init__(name, help_text, labels)
+        self.function = function
+    
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+    
+    def _samples(self):
+        if self.function is not None:
+            values = self.function()
+            if not isinstance(values, dict):
+                values = {(): values}
+            with self._lock:
+                self._values = {tuple(str(v) for v in key): value for key, value in values.items()}
+        return super()._samples()
+
+class Histogram(Metric):
+    type_name = "histogram"
+    
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+    
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Per-bucket counts (not cumulative), then sum
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-1] += value
+    
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the with block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+    
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, list(counts)) for key, counts in self._values.items())
+        lines = []
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _label_text(self.label_names, key, [("le", _number(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_number(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """Collection of metrics rendered in the Prometheus text format"""
+    
+    def __init__(self):
+        self._metrics = []
+    
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+    
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+class SampledLog:
+    """
+    Verbose per-request output (prompts, raw model output, user text)
+    Only a `rate` fraction of requests is logged: 0 turns it off, 1 logs all
+    """
+    
+    def __init__(self, rate=0.0):
+        self.rate = rate
+    
+    def sampled(self):
+        """Decide once per request whether its details get logged"""
+        return self.rate > 0 and random.random() < self.rate
+    
+    @staticmethod
+    def log(title, text):
+        print(f"--- {title} ---\n{text}\n--- END {title} ---\n")
+
+registry = MetricsRegistry()
+debug_log = SampledLog()
+
+# Chat request stages: sentiment, language_detect, prompt_build, prompt_eval, decode, post_process
+STAGE_SECONDS = registry.register(Histogram(
+    "sleepyhead_stage_seconds", "Time spent per chat request stage", labels=("stage",)
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    "sleepyhead_request_seconds", "Chat request latency, until the last byte of the reply", labels=("endpoint",)
+))
+PROMPT_TOKENS = registry.register(Counter(
+    "sleepyhead_prompt_tokens_total", "Prompt tokens sent to the model"
+))
+PROMPT_TOKENS_EVALUATED = registry.register(Counter(
+    "sleepyhead_prompt_tokens_evaluated_total", "Prompt tokens actually evaluated (not reused from the KV cache)"
+))
+COMPLETION_TOKENS = registry.register(Counter(
+    "sleepyhead_completion_tokens_total", "Tokens generated by the model"
+))
+TOKENS_PER_SECOND = registry.register(Histogram(
+    "sleepyhead_decode_tokens_per_second", "Decode speed per generation", buckets=TOKENS_PER_SECOND_BUCKETS
+))
+REPLIES = registry.register(Counter(
+    "sleepyhead_replies_total", "Chat replies by outcome (model or canned fallback)", labels=("outcome",)
+))
+MODEL_REQUESTS = registry.register(Counter(
+    "sleepyhead_model_requests_total", "Chat generations by the model that served them", labels=("model",)
+))
+COALESCED_REQUESTS = registry.register(Counter(
+    "sleepyhead_coalesced_requests_total", "Duplicate chat requests answered by another request's generation",
+    labels=("state",)
+))
+DRAFT_TOKENS = registry.register(Counter(
+    "sleepyhead_draft_tokens_total", "Speculative decoding draft tokens by result (accepted or rejected)",
+    labels=("result",)
+))
+CACHE_LOOKUPS = registry.register(Counter(
+    "sleepyhead_cache_lookups_total", "Response, KV prefix and sentiment cache lookups", labels=("cache", "result")
+))
+
+def _cache_hit_ratios():
+    ratios = {}
+    for cache in ("response", "prefix", "sentiment"):
+        hits = CACHE_LOOKUPS.value(cache=cache, result="hit")
+        lookups = hits + CACHE_LOOKUPS.value(cache=cache, result="miss")
+        ratios[(cache,)] = hits / lookups if lookups else 0.0
+    return ratios
+
+CACHE_HIT_RATIO = registry.register(Gauge(
+    "sleepyhead_cache_hit_ratio", "Hit ratio of the response, KV prefix and sentiment caches since start",
+    labels=("cache",), function=_cache_hit_ratios
+))
+
+def _draft_acceptance_rate():
+    accepted = DRAFT_TOKENS.value(result="accepted")
+    drafted = accepted + DRAFT_TOKENS.value(result="rejected")
+    return accepted / drafted if drafted else 0.0
+
+DRAFT_ACCEPTANCE_RATE = registry.register(Gauge(
+    "sleepyhead_draft_acceptance_rate", "Share of speculative draft tokens the model accepted since start",
+    function=_draft_acceptance_rate
+))
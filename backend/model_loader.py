@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+
+from inference_scheduler import InferenceScheduler
+
+class ModelNotReadyError(Exception):
+    """Raised when chat work is submitted before the model finished loading"""
+    
+    def __init__(self, state, error=None, retry_after=10):
+        if state == 'failed':
+            super().__init__(f"Model failed to load: {error}")
+            # Retrying will not help until the server is fixed and restarted
+            self.retry_after = None
+        else:
+            super().__init__(f"Model is not available ({state}), please retry shortly")
+            self.retry_after = retry_after
+        self.state = state
+
+class ModelLoader:
+    """
+    Loads the LLM workers in a background thread
+    The server can bind and answer sentiment requests right away; chat work is
+    only accepted once every worker is loaded and one warm-up generation has
+    run. State goes pending -> loading -> warming_up -> ready, or failed, and
+    on shutdown ready -> draining -> stopped.
+    """
+    
+    def __init__(self, model_path, handler_factory, num_workers=1, scheduler_options=None, warm_up=True):
+        self.model_path = model_path
+        self.handler_factory = handler_factory
+        self.num_workers = num_workers
+        self.scheduler_options = scheduler_options or {}
+        self.warm_up = warm_up
+        self.state = 'pending'
+        self.error = None
+        self.workers_loaded = 0
+        self.contexts_loaded = 0
+        self.scheduler = None
+        self._started_at = None
+        self._load_seconds = None
+        self._warm_up_seconds = None
+        self._thread = None
+        self._stop_requested = False
+    
+    @property
+    def ready(self):
+        return self.state == 'ready'
+    
+    def start(self):
+        """Start loading in the background; safe to call more than once"""
+        if self._thread is None:
+            self._started_at = time.monotonic()
+            self._thread = threading.Thread(target=self._load, name="llm-model-loader", daemon=True)
+            self._thread.start()
+    
+    def wait(self, timeout=None):
+        """Block until loading finished (ready or failed); returns True when ready"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.ready
+    
+    def get_scheduler(self):
+        """The inference scheduler, or ModelNotReadyError while it is unavailable"""
+        if not self.ready:
+            raise ModelNotReadyError(self.state, self.error)
+        return self.scheduler
+    
+    def shutdown(self, drain_timeout=60):
+        """
+        Stop taking chat work and let queued and running generations finish
+        The workers are stopped once drained; returns False if that took
+        longer than drain_timeout seconds (the workers are left to die with
+        the process then)
+        """
+        scheduler = self.scheduler
+        if scheduler is None:
+            # Still loading: the workers are stopped as soon as they exist
+            self._stop_requested = True
+            return True
+        if self.state in ('draining', 'stopped'):
+            return True
+        
+        self.state = 'draining'
+        print(f"Draining {scheduler.queue_depth + scheduler.active_jobs} in-flight generation(s)...")
+        drained = scheduler.drain(drain_timeout)
+        if drained:
+            scheduler.shutdown()
+        else:
+            print(f"WARNING: generations still running after {drain_timeout}s, stopping anyway")
+        self.state = 'stopped'
+        return drained
+    
+    def status(self):
+        status = {
+            "state": self.state,
+            "model": os.path.basename(self.model_path),
+            "workers_loaded": self.workers_loaded,
+            "workers_total": self.num_workers,
+            "contexts_loaded": self.contexts_loaded,
+            "load_seconds": self._load_seconds,
+            "warm_up_seconds": self._warm_up_seconds
+        }
+        if self._started_at is not None and self.state in ('pending', 'loading', 'warming_up'):
+            status["elapsed_seconds"] = round(time.monotonic() - self._started_at, 1)
+        if self.error:
+            status["error"] = self.error
+        return status
+    
+    def _load(self):
+        try:
+            if not os.path.exists(self.model_path):
+                raise FileNotFoundError(
+                    f"Model file not found: {self.model_path} (run python download_model.py)"
+                )
+            
+            self.state = 'loading'
+            print(f"Loading model in the background: {self.model_path}")
+            
+            # Workers can share a handler (one batched context for all of them)
+            handlers = {}
+            
+            def load_handler():
+                handler = self.handler_factory()
+                self.workers_loaded += 1
+                if id(handler) not in handlers:
+                    handlers[id(handler)] = handler
+                    self.contexts_loaded = len(handlers)
+                    print(f"Model context {self.contexts_loaded} loaded")
+                return handler
+            
+            scheduler = InferenceScheduler(load_handler, num_workers=self.num_workers, **self.scheduler_options)
+            self._load_seconds = round(time.monotonic() - self._started_at, 1)
+            print(f"{self.num_workers} model worker(s) on {self.contexts_loaded} context(s)")
+            
+            if self.warm_up:
+                # Page in the weights and allocate compute buffers before real traffic
+                self.state = 'warming_up'
+                warm_up_started = time.monotonic()
+                for handler in handlers.values():
+                    handler.warm_up()
+                self._warm_up_seconds = round(time.monotonic() - warm_up_started, 1)
+            
+            if self._stop_requested:
+                scheduler.shutdown()
+                self.state = 'stopped'
+                print("Model load finished after shutdown was requested; workers stopped")
+                return
+            
+            self.scheduler = scheduler
+            self.state = 'ready'
+            print(f"Model ready (load {self._load_seconds}s, warm-up {self._warm_up_seconds}s)")
+        
+        except Exception as e:
+            self.error = str(e)
+            self.state = 'failed'
+            print(f"Error: model failed to load: {e}")
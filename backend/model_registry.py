@@ -0,0 +1,226 @@
+from collections import OrderedDict
+import os
+import threading
+
+class ModelSpec:
+    """A GGUF file the registry can load, with its chat template, context size and draft model"""
+    
+    def __init__(self, key, path, chat_template='chatml', n_ctx=4096, draft_path=None):
+        self.key = key
+        self.path = path
+        self.chat_template = chat_template
+        self.n_ctx = n_ctx
+        self.draft_path = draft_path
+    
+    @property
+    def size_bytes(self):
+        """Weights size (with the draft model); with mmap this is what a loaded model keeps resident"""
+        size = 0
+        for path in (self.path, self.draft_path):
+            try:
+                size += os.path.getsize(path) if path else 0
+            except OSError:
+                pass
+        return size
+    
+    def describe(self):
+        description = {"path": os.path.basename(self.path), "chat_template": self.chat_template, "n_ctx": self.n_ctx}
+        if self.draft_path:
+            description["draft"] = os.path.basename(self.draft_path)
+        return description
+
+class ModelRegistry:
+    """
+    Chat models by key, each served by its own ModelLoader (and worker pool)
+    The default model loads at start and stays loaded. Other models load on
+    first use and requests fall back to the default model until they are
+    ready. Loading a model that would push the weights over memory_budget
+    unloads the least recently used other models first (0 = no budget).
+    routes maps a sentiment tone to the key of the model that answers it.
+    """
+    
+    def __init__(self, loader_factory, specs, default_key, routes=None, memory_budget=0, drain_timeout=60):
+        self.loader_factory = loader_factory  # ModelSpec -> ModelLoader, not started
+        self.specs = {spec.key: spec for spec in specs}
+        if default_key not in self.specs:
+            raise ValueError(f"Default model '{default_key}' is not registered")
+        self.default_key = default_key
+        self.routes = dict(routes or {})
+        self.memory_budget = memory_budget
+        self.drain_timeout = drain_timeout
+        self._loaders = OrderedDict()  # least recently used first
+        self._swaps = {}  # key -> loader being loaded to replace the current one
+        self._errors = {}
+        self._lock = threading.Lock()
+    
+    def start(self):
+        """Start loading the default model"""
+        with self._lock:
+            self._load(self.default_key)
+    
+    def wait(self, timeout=None):
+        """Block until the default model finished loading; returns True when ready"""
+        return self._loaders[self.default_key].wait(timeout)
+    
+    @property
+    def ready(self):
+        loader = self._loaders.get(self.default_key)
+        return loader is not None and loader.ready
+    
+    def route(self, tone):
+        """Key of the model that should answer a tone"""
+        key = self.routes.get(tone, self.default_key)
+        return key if key in self.specs else self.default_key
+    
+    def get_scheduler(self, tone=None):
+        """
+        Inference scheduler for a request
+        Returns (model key, scheduler); raises ModelNotReadyError when not even
+        the default model can take it
+        """
+        key = self.route(tone)
+        with self._lock:
+            loader = self._loaders.get(key)
+            if loader is None and key not in self._errors:
+                loader = self._load(key)
+            if loader is not None and loader.ready:
+                self._loaders.move_to_end(key)
+                return key, loader.scheduler
+            default = self._loaders[self.default_key]
+        return self.default_key, default.get_scheduler()
+    
+    def serving(self, tone=None):
+        """(key, model file) of the model that answers a tone right now, without loading anything"""
+        key = self.route(tone)
+        with self._lock:
+            loader = self._loaders.get(key)
+            if loader is None or not loader.ready:
+                key, loader = self.default_key, self._loaders[self.default_key]
+        return key, loader.model_path
+    
+    def schedulers(self):
+        """Schedulers of the ready models"""
+        return [loader.scheduler for loader in list(self._loaders.values()) if loader.ready]
+    
+    def swap(self, key, spec=None):
+        """
+        Load a model (again) without interrupting requests
+        spec registers or replaces the model's file/template. The current
+        instance keeps serving until the new one is ready; it is then drained
+        and unloaded in the background. A failed load leaves it in place.
+        """
+        with self._lock:
+            if spec is not None:
+                self.specs[key] = spec
+            if key not in self.specs:
+                raise KeyError(key)
+            if key in self._swaps:
+                return
+            self._errors.pop(key, None)
+            if key not in self._loaders:
+                self._load(key)
+                return
+            # Old and new instance are both loaded for a moment, even over budget
+            self._make_room(self.specs[key].size_bytes, keep=key)
+            loader = self.loader_factory(self.specs[key])
+            self._swaps[key] = loader
+        loader.start()
+        threading.Thread(target=self._finish_swap, args=(key, loader), name=f"model-swap-{key}", daemon=True).start()
+    
+    def unload(self, key):
+        """Drain and unload a model in the background; the default model stays"""
+        if key == self.default_key:
+            raise ValueError("The default model cannot be unloaded")
+        with self._lock:
+            loader = self._loaders.pop(key, None)
+            self._errors.pop(key, None)
+        if loader is not None:
+            self._retire(loader)
+    
+    def default_status(self):
+        """ModelLoader.status() of the default model"""
+        return self._loaders[self.default_key].status()
+    
+    def status(self):
+        with self._lock:
+            models = {}
+            for key, spec in self.specs.items():
+                loader = self._loaders.get(key)
+                status = loader.status() if loader is not None else {"state": "unloaded"}
+                status.update(spec.describe())
+                status["size_mb"] = round(spec.size_bytes / (1024 * 1024))
+                if key in self._swaps:
+                    status["swap"] = self._swaps[key].status()
+                if key in self._errors:
+                    status["error"] = self._errors[key]
+                models[key] = status
+            return {
+                "default": self.default_key,
+                "routes": self.routes,
+                "memory_budget_mb": round(self.memory_budget / (1024 * 1024)),
+                "loaded_mb": round(self._loaded_bytes() / (1024 * 1024)),
+                "models": models
+            }
+    
+    def shutdown(self, drain_timeout=60):
+        """Drain every model; returns False if some did not finish in time"""
+        with self._lock:
+            loaders = list(self._loaders.values()) + list(self._swaps.values())
+        drained = True
+        for loader in loaders:
+            drained = loader.shutdown(drain_timeout) and drained
+        return drained
+    
+    def _load(self, key):
+        """Start loading key's model; caller holds the lock"""
+        spec = self.specs[key]
+        # The default model loads whatever the budget says; the others have to fit
+        if not self._make_room(spec.size_bytes, keep=key) and key != self.default_key:
+            self._errors[key] = "Does not fit in the model memory budget"
+            print(f"WARNING: model {key} does not fit in the memory budget, using {self.default_key}")
+            return None
+        loader = self.loader_factory(spec)
+        self._loaders[key] = loader
+        loader.start()
+        return loader
+    
+    def _loaded_bytes(self):
+        loaders = list(self._loaders.items()) + list(self._swaps.items())
+        return sum(
+            self.specs[key].size_bytes for key, loader in loaders
+            if key in self.specs and loader.state not in ('failed', 'stopped')
+        )
+    
+    def _make_room(self, size_bytes, keep):
+        """Unload least recently used models until size_bytes more fit; caller holds the lock"""
+        if not self.memory_budget:
+            return True
+        for key in list(self._loaders):
+            if self._loaded_bytes() + size_bytes <= self.memory_budget:
+                break
+            if key in (keep, self.default_key):
+                continue
+            print(f"Unloading model {key} to stay within the memory budget")
+            self._retire(self._loaders.pop(key))
+        return self._loaded_bytes() + size_bytes <= self.memory_budget
+    
+    def _finish_swap(self, key, loader):
+        ready = loader.wait()
+        with self._lock:
+            del self._swaps[key]
+            old = None
+            if ready:
+                old = self._loaders.pop(key, None)
+                self._loaders[key] = loader
+            else:
+                self._errors[key] = f"Swap failed, still serving the previous model: {loader.error}"
+        if ready:
+            print(f"Model {key} swapped in")
+            if old is not None:
+                self._retire(old)
+    
+    def _retire(self, loader):
+        # In-flight generations finish on the old instance; its memory goes with the last reference
+        threading.Thread(
+            target=loader.shutdown, args=(self.drain_timeout,), name="model-retire", daemon=True
+        ).start()
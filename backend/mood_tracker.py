@@ -0,0 +1,101 @@
+from collections import OrderedDict, deque
+import math
+import threading
+import time
+
+TONES = ("very_positive", "positive", "neutral", "negative", "very_negative")
+
+# Smoothing of the short- and long-term mood averages; their difference is the trend
+FAST_ALPHA = 0.3
+SLOW_ALPHA = 0.05
+
+class MoodStats:
+    """
+    Running sentiment statistics of one session, updated in O(1) per message
+    Mean and standard deviation of the compound score (Welford), tone counts,
+    short and long exponential moving averages (trend = short - long) and the
+    last few scores for sparklines.
+    """
+    
+    __slots__ = ('count', 'mean', '_m2', 'tones', 'fast', 'slow', 'recent', 'first_seen', 'last_seen')
+    
+    def __init__(self, recent_size=20):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.tones = dict.fromkeys(TONES, 0)
+        self.fast = 0.0
+        self.slow = 0.0
+        self.recent = deque(maxlen=recent_size)
+        self.first_seen = None
+        self.last_seen = None
+    
+    def add(self, compound, tone, timestamp):
+        self.count += 1
+        delta = compound - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (compound - self.mean)
+        self.tones[tone] = self.tones.get(tone, 0) + 1
+        if self.count == 1:
+            self.fast = self.slow = compound
+            self.first_seen = timestamp
+        else:
+            self.fast += FAST_ALPHA * (compound - self.fast)
+            self.slow += SLOW_ALPHA * (compound - self.slow)
+        self.recent.append((timestamp, compound))
+        self.last_seen = timestamp
+    
+    def summary(self):
+        return {
+            "messages": self.count,
+            "mean_compound": round(self.mean, 4),
+            "std_compound": round(math.sqrt(self._m2 / self.count), 4) if self.count else 0.0,
+            "tones": dict(self.tones),
+            "recent_mood": round(self.fast, 4),
+            "trend": round(self.fast - self.slow, 4),
+            "recent": [{"time": timestamp, "compound": compound} for timestamp, compound in self.recent],
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen
+        }
+
+class MoodTracker:
+    """
+    Rolling mood per session_id, plus one aggregate over all sessions
+    Sessions are kept LRU up to max_sessions; the aggregate keeps counting
+    after a session is evicted.
+    """
+    
+    def __init__(self, max_sessions=1000, recent_size=20):
+        self.max_sessions = max_sessions
+        self.recent_size = recent_size
+        self.overall = MoodStats(recent_size)
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def record(self, session_id, sentiment_result, tone):
+        """Add one analyzed message (SentimentAnalyzer.analyze result and its tone); session_id None only counts overall"""
+        timestamp = time.time()
+        with self._lock:
+            self.overall.add(sentiment_result['compound'], tone, timestamp)
+            if session_id is None:
+                return
+            stats = self._sessions.get(session_id)
+            if stats is None:
+                stats = self._sessions[session_id] = MoodStats(self.recent_size)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            stats.add(sentiment_result['compound'], tone, timestamp)
+    
+    def summary(self, session_id=None):
+        """Stats of one session (None if unknown), or of all sessions without session_id"""
+        with self._lock:
+            if session_id is None:
+                return dict(self.overall.summary(), sessions=len(self._sessions))
+            stats = self._sessions.get(session_id)
+            return stats.summary() if stats is not None else None
+    
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
@@ -0,0 +1,279 @@
+import re
+
+from chat_templates import SPECIAL_TOKENS
+from metrics import REPLIES
+
+# End-of-turn and role markers of every chat template
+SPECIAL_TOKEN_PATTERN = re.compile("|".join(re.escape(token) for token in SPECIAL_TOKENS))
+# Unfinished special tokens at the end of streamed text
+SPECIAL_TOKEN_LENGTH = max(len(token) for token in SPECIAL_TOKENS)
+SPECIAL_TOKEN_PREFIXES = {token[:length] for token in SPECIAL_TOKENS for length in range(1, len(token))}
+
+# AI/explanatory phrases removed from model output
+AI_PATTERNS = [
+    r"As an AI[^.!?]*[.!?]",
+    r"I(?:'m| am) an AI[^.!?]*[.!?]",
+    r"Aapne ye bola[^.!?]*[.!?]",
+    r"which means[^.!?]*[.!?]",
+    r"It seems like[^.!?]*[.!?]",
+    r"translation:[^.!?]*[.!?]",
+    r"means \"[^\"]*\"",
+    r"So feel free[^.!?]*[.!?]",
+]
+# All of the above in one pass
+AI_PATTERN = re.compile("|".join(f"(?:{pattern})" for pattern in AI_PATTERNS), re.IGNORECASE)
+
+# Lowercase openings of the AI/explanatory patterns, used to hold back streamed text
+AI_PATTERN_OPENINGS = [
+    "as an ai",
+    "i'm an ai",
+    "i am an ai",
+    "aapne ye bola",
+    "which means",
+    "it seems like",
+    "translation:",
+    "means \"",
+    "so feel free",
+]
+# Where the next opening starts, and text that could still grow into one
+AI_OPENING_PATTERN = re.compile("|".join(re.escape(opening) for opening in AI_PATTERN_OPENINGS), re.IGNORECASE)
+AI_OPENING_PREFIXES = {opening[:length] for opening in AI_PATTERN_OPENINGS for length in range(1, len(opening) + 1)}
+OPENING_LENGTH = max(len(opening) for opening in AI_PATTERN_OPENINGS)
+
+# Replies are cut after this many sentences
+MAX_SENTENCES = 2
+# Longer replies are replaced by a fallback
+MAX_REPLY_LENGTH = 200
+
+# Used when the model output is empty, too short or too long
+FALLBACK_RESPONSES = {
+    "hinglish": {
+        "very_positive": "Arre wah bhai! 😊",
+        "positive": "Nice yaar!",
+        "neutral": "Haan bro, bol",
+        "negative": "Yaar... kya hua?",
+        "very_negative": "I'm here yaar 💙"
+    },
+    "english": {
+        "very_positive": "That's awesome! 😊",
+        "positive": "Nice!",
+        "neutral": "Yeah, what's up?",
+        "negative": "Hey... what happened?",
+        "very_negative": "I'm here for you 💙"
+    }
+}
+
+def strip_special_tokens(text):
+    return SPECIAL_TOKEN_PATTERN.sub("", text)
+
+def strip_ai_patterns(text):
+    """Remove AI/explanatory patterns"""
+    return AI_PATTERN.sub("", text)
+
+def truncate_sentences(text, limit=MAX_SENTENCES):
+    """Keep the first `limit` sentences (split on '. ') and end them with a period"""
+    if '. ' not in text:
+        return text
+    
+    end = -1
+    for _ in range(limit):
+        end = text.find('. ', end + 1)
+        if end < 0:
+            end = len(text)
+            break
+    # Keep the period, so a sentence ending in "..." keeps all three dots as streamed
+    text = text[:end + 1]
+    
+    if not text.endswith('.'):
+        text += '.'
+    return text
+
+def clean_line(line):
+    """Cleanup rules for the first line of model output"""
+    return truncate_sentences(strip_ai_patterns(line).strip())
+
+def clean_response(response_text, tone, language):
+    """
+    Turn raw model output into the final reply
+    Falls back to a canned response when the output is unusable
+    """
+    response_text = strip_special_tokens(response_text.strip()).strip()
+    response_text = clean_line(response_text.split('\n')[0])  # Only take first line
+    return usable_or_fallback(response_text, tone, language)
+
+def usable_or_fallback(response_text, tone, language):
+    # If response is still problematic or too short, use fallback
+    if not response_text or len(response_text) < 5 or len(response_text) > MAX_REPLY_LENGTH:
+        print(f"WARNING: Model response problematic, using fallback")
+        fallback_responses = FALLBACK_RESPONSES.get(language, FALLBACK_RESPONSES["english"])
+        response_text = fallback_responses.get(tone, "Tell me more")
+        REPLIES.inc(outcome='fallback')
+    else:
+        REPLIES.inc(outcome='model')
+    
+    return response_text
+
+class StreamFilter:
+    """
+    clean_response for a token stream
+    feed() returns the newly visible text; anything that could still turn into
+    an AI/explanatory phrase is held back. `complete` turns True once the
+    first line or the sentence limit is done - later tokens cannot change the
+    reply any more, so generation can stop there. With stop_at_ai_phrase the
+    reply is also complete as soon as an AI/explanatory phrase starts; it is
+    cut right before the phrase. Once the settled text is over MAX_REPLY_LENGTH
+    the reply can only be the fallback: it is complete, and none of the
+    text that crossed the limit is handed out.
+    Each feed() only scans the new text: the first line is scanned left to
+    right like AI_PATTERN.sub, and everything before a held back phrase is
+    settled, so the next feed() continues from there.
+    """
+    
+    def __init__(self, stop_at_ai_phrase=False):
+        self.stop_at_ai_phrase = stop_at_ai_phrase
+        self.raw_text = ""
+        self.text = ""  # text handed out so far
+        self.complete = False
+        self._complete_text = None
+        self._raw_offset = 0  # raw_text up to here is in _line
+        self._line = ""  # first line without special tokens and leading whitespace
+        self._line_done = False
+        self._scan = 0  # _line up to here is settled
+        self._kept = ""  # settled part of _line without AI/explanatory phrases
+        self._sentence_ends = 0  # '. ' in _kept
+    
+    def feed(self, chunk):
+        """Add generated text; returns the part of the reply that became visible"""
+        self.raw_text += chunk
+        if self.complete:
+            return ""
+        return self._advance(self._visible_text())
+    
+    def finish(self, tone, language):
+        """
+        Clean the whole output once generation ended
+        Returns (text not handed out yet, final reply)
+        """
+        if self.complete:
+            # Already cut; cleaning the raw text again could strip the space that ended a sentence
+            response_text = usable_or_fallback(self._complete_text, tone, language)
+        else:
+            response_text = clean_response(self.raw_text, tone, language)
+        return self._advance(response_text), response_text
+    
+    def _advance(self, visible_text):
+        # Only ever append to what has already been handed out
+        if len(visible_text) > len(self.text) and visible_text.startswith(self.text):
+            delta = visible_text[len(self.text):]
+            self.text = visible_text
+            return delta
+        return ""
+    
+    def _visible_text(self):
+        text = self._settled_text()
+        if len(text) > MAX_REPLY_LENGTH:
+            # Later output can only make the reply longer, so finish() falls back
+            self._set_complete(text)
+            return self.text
+        return text
+    
+    def _settled_text(self):
+        self._extend_line()
+        line = self._line
+        if self._line_done:
+            return self._set_complete(clean_line(line))
+        
+        hold_back = self._scan_line()
+        text = self._kept.lstrip()
+        if self._sentence_ends >= MAX_SENTENCES:
+            return self._set_complete(truncate_sentences(text))
+        if self.stop_at_ai_phrase and line[hold_back:hold_back + OPENING_LENGTH].lower().startswith(
+            tuple(AI_PATTERN_OPENINGS)
+        ):
+            return self._set_complete(clean_line(line[:hold_back]))
+        # Trailing spaces go out with the next word, so the final '.' can still be appended
+        return text.rstrip()
+    
+    def _set_complete(self, text):
+        self.complete = True
+        self._complete_text = text
+        return text
+    
+    def _extend_line(self):
+        """
+        Move new raw text into _line, without special tokens
+        A possibly unfinished special token at the end waits for the next feed()
+        """
+        if self._line_done:
+            return
+        new = self.raw_text[self._raw_offset:]
+        end = len(new)
+        for length in range(min(len(new), SPECIAL_TOKEN_LENGTH - 1), 0, -1):
+            if new[-length:] in SPECIAL_TOKEN_PREFIXES:
+                end -= length
+                break
+        # Never split a complete special token
+        for match in SPECIAL_TOKEN_PATTERN.finditer(new):
+            if match.start() < end < match.end():
+                end = match.end()
+        self._raw_offset += end
+        
+        text = strip_special_tokens(new[:end])
+        if not self._line:
+            text = text.lstrip()
+        text, newline, _ = text.partition('\n')
+        self._line += text
+        self._line_done = bool(newline)
+    
+    def _scan_line(self):
+        """
+        Settle _line up to where a possibly unfinished AI/explanatory phrase starts
+        Scans like AI_PATTERN.sub does, so phrases that already matched are
+        dropped from _kept. Returns the settled length, len(_line) when
+        everything can be shown.
+        """
+        line = self._line
+        start = kept_from = self._scan
+        while start < len(line):
+            # Plain text up to the next opening, unless the end of the line could still grow into one
+            next_opening = AI_OPENING_PATTERN.search(line, start)
+            stop = next_opening.start() if next_opening else len(line)
+            for position in range(max(start, len(line) - OPENING_LENGTH + 1), stop):
+                if line[position:].lower() in AI_OPENING_PREFIXES:
+                    stop = position
+                    break
+            else:
+                match = AI_PATTERN.match(line, stop) if next_opening else None
+                if match and match.end() > stop:
+                    self._keep(line[kept_from:stop])
+                    start = kept_from = match.end()
+                    continue
+            # Held back: a phrase that could still grow or has not matched yet, or the end of the line
+            start = stop
+            break
+        
+        self._keep(line[kept_from:start])
+        self._scan = start
+        return start
+    
+    def _keep(self, text):
+        if text:
+            self._sentence_ends += (self._kept[-1:] + text).count('. ')
+            self._kept += text
+
+def reply_done_check(stop_at_ai_phrase=False):
+    """
+    should_stop(completion_text) for one generation: True once more model
+    output can no longer change the cleaned reply. Each call only scans the
+    text added since the previous one.
+    """
+    stream_filter = StreamFilter(stop_at_ai_phrase)
+    
+    def reply_done(completion_text):
+        nonlocal stream_filter
+        if not completion_text.startswith(stream_filter.raw_text):
+            stream_filter = StreamFilter(stop_at_ai_phrase)
+        stream_filter.feed(completion_text[len(stream_filter.raw_text):])
+        return stream_filter.complete
+    
+    return reply_done
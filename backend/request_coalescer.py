@@ -0,0 +1,92 @@
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import time
+
+from metrics import COALESCED_REQUESTS
+
+class IdempotencyKeyReusedError(Exception):
+    """An Idempotency-Key came back with a different request"""
+
+class _Entry:
+    __slots__ = ('done', 'result', 'error', 'finished', 'fingerprint')
+    
+    def __init__(self, fingerprint):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished = None
+        self.fingerprint = fingerprint
+
+class RequestCoalescer:
+    """
+    One computation per duplicate request
+    Requests with the same key while one is running wait for it and get its
+    result (or its error). Keys come from the client's Idempotency-Key, else
+    from the session, message and history the request arrived with.
+    Results of Idempotency-Key requests are kept for ttl seconds so retries of
+    a finished request get them too; errors are not kept, a retry runs again.
+    Content keys only match while the request runs: once it finishes, the
+    same message is a new turn the user sent on purpose.
+    """
+    
+    def __init__(self, ttl=60, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(session_id, message, history=None, idempotency_key=None):
+        if idempotency_key:
+            return ('key', session_id, idempotency_key)
+        recent_history = [(turn.role, turn.text) for turn in (history or [])]
+        content = json.dumps([message, recent_history])
+        return ('content', session_id, hashlib.sha1(content.encode('utf-8')).hexdigest())
+    
+    def run(self, key, compute, message=None):
+        """
+        compute() once per key
+        message is the request's content; a key that comes back with another
+        message raises IdempotencyKeyReusedError instead of getting the result.
+        Returns (result, whether it came from another request)
+        """
+        fingerprint = hashlib.sha1(json.dumps(message).encode('utf-8')).hexdigest()
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = self._entries[key] = _Entry(fingerprint)
+        
+        if not owner:
+            if entry.fingerprint != fingerprint:
+                raise IdempotencyKeyReusedError("Idempotency-Key was already used for a different request")
+            COALESCED_REQUESTS.inc(state='in_flight' if not entry.done.is_set() else 'finished')
+            entry.done.wait()
+            if entry.error is not None:
+                raise entry.error
+            return entry.result, True
+        
+        try:
+            entry.result = compute()
+        except BaseException as e:
+            entry.error = e
+            raise
+        finally:
+            entry.finished = time.monotonic()
+            # Only results of Idempotency-Key requests (see make_key) outlive the request
+            if entry.error is not None or key[0] != 'key':
+                with self._lock:
+                    self._entries.pop(key, None)
+            entry.done.set()
+        return entry.result, False
+    
+    def _expire(self):
+        """Drop finished results past ttl, and the oldest finished ones past max_entries; caller holds the lock"""
+        now = time.monotonic()
+        finished = [key for key, entry in self._entries.items() if entry.finished is not None]
+        for key in finished:
+            if now - self._entries[key].finished > self.ttl or len(self._entries) > self.max_entries:
+                del self._entries[key]
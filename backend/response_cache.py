@@ -0,0 +1,86 @@
+from collections import OrderedDict
+import hashlib
+import json
+import re
+import threading
+import time
+
+from metrics import CACHE_LOOKUPS
+
+class ResponseCache:
+    """
+    Cache of chat replies for repeated messages
+    Keyed on (model, language, tone, normalized message, history in the prompt). Entries
+    expire after ttl seconds and the least recently used are evicted past
+    max_entries. With variants > 1 a key collects that many different replies
+    before it starts answering from cache, then rotates through them.
+    """
+    
+    def __init__(self, max_entries=1024, ttl=600, variants=1):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.variants = max(1, variants)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def normalize(message):
+        """Lowercase, collapse whitespace and drop trailing punctuation"""
+        message = re.sub(r'\s+', ' ', message.lower()).strip()
+        return message.rstrip('.!?~ ')
+    
+    def make_key(self, message, language, tone, history=None, model=None):
+        # Every history turn (session_store.Turn) the prompt can include shapes the
+        # reply, so callers pass Session.context_turns rather than the latest few.
+        # model (ModelRegistry.serving) keeps replies of a swapped out model from being served
+        history = [(turn.role, turn.text) for turn in (history or [])]
+        history_hash = hashlib.sha1(json.dumps(history).encode('utf-8')).hexdigest()
+        return (model, language, tone, self.normalize(message), history_hash)
+    
+    def get(self, key):
+        """Return a cached reply, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry['created'] > self.ttl:
+                del self._entries[key]
+                entry = None
+            
+            # Keep generating until the key has enough variety
+            if entry is None or entry['generated'] < self.variants:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache='response', result='miss')
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_LOOKUPS.inc(cache='response', result='hit')
+            response = entry['responses'][entry['next']]
+            entry['next'] = (entry['next'] + 1) % len(entry['responses'])
+            return response
+    
+    def put(self, key, response):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {'created': time.monotonic(), 'responses': [], 'next': 0, 'generated': 0}
+                self._entries[key] = entry
+            
+            # Identical replies count towards variety too, so a key always fills up
+            entry['generated'] += 1
+            if response not in entry['responses'] and len(entry['responses']) < self.variants:
+                entry['responses'].append(response)
+            self._entries.move_to_end(key)
+            
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+llama.cpp runtime settings for this machine
+Threads, batch size, GPU layers, mmap/mlock and a context cap come from, in
+order of precedence: LLM_* environment variables, the profile saved by
+`autotune` for the model, and defaults derived from the detected CPU cores.
+
+Usage:
+    python runtime_config.py show [--model FILE] [--workers N]
+    python runtime_config.py autotune --model FILE [--workers N] [--quick]
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from llama_cpp import Llama
+
+PROFILE_PATH = os.getenv('LLM_PROFILE', os.path.join(os.path.dirname(__file__), 'runtime_profile.json'))
+
+# Fields a profile can set, with the environment variable overriding each
+ENV_SETTINGS = {
+    "n_threads": "LLM_THREADS",
+    "n_threads_batch": "LLM_THREADS_BATCH",
+    "n_batch": "LLM_BATCH_SIZE",
+    "n_gpu_layers": "LLM_GPU_LAYERS",
+    "n_ctx": "LLM_CONTEXT_CAP",
+}
+
+def cpu_cores():
+    """
+    (physical, logical) cores this process may run on
+    Physical cores come from psutil when installed, else from the Linux CPU
+    topology; elsewhere half the logical cores are assumed to be SMT siblings.
+    """
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = list(range(os.cpu_count() or 1))
+    logical = len(cpus)
+    
+    try:
+        import psutil
+        physical = psutil.cpu_count(logical=False)
+        if physical:
+            # Scale to the CPUs in our affinity mask
+            return max(1, round(physical * logical / psutil.cpu_count())), logical
+    except ImportError:
+        pass
+    
+    cores = set()
+    for cpu in cpus:
+        topology = f"/sys/devices/system/cpu/cpu{cpu}/topology/"
+        try:
+            with open(topology + "physical_package_id") as f, open(topology + "core_id") as g:
+                cores.add((f.read().strip(), g.read().strip()))
+        except OSError:
+            cores = None
+            break
+    if cores:
+        return len(cores), logical
+    return max(1, logical // 2), logical
+
+def machine_id():
+    """What a profile was tuned on; profiles from other hardware are ignored"""
+    physical, logical = cpu_cores()
+    return f"{platform.machine()} {platform.processor() or platform.system()} {physical}c/{logical}t"
+
+class RuntimeConfig:
+    """
+    llama.cpp settings for one model's contexts
+    n_threads is used while decoding (memory bound, one token at a time),
+    n_threads_batch while evaluating prompts (compute bound). n_ctx, when set,
+    caps the model's context size.
+    """
+    
+    def __init__(self, n_threads, n_threads_batch=None, n_batch=512, n_gpu_layers=0,
+                 use_mmap=True, use_mlock=False, n_ctx=None, source="defaults"):
+        self.n_threads = n_threads
+        self.n_threads_batch = n_threads_batch or n_threads
+        self.n_batch = n_batch
+        self.n_gpu_layers = n_gpu_layers
+        self.use_mmap = use_mmap
+        self.use_mlock = use_mlock
+        self.n_ctx = n_ctx
+        self.source = source
+    
+    @classmethod
+    def detect(cls, workers=1):
+        """Defaults for this machine: the physical cores split between the workers"""
+        physical, _ = cpu_cores()
+        threads = max(1, physical // max(1, workers))
+        return cls(n_threads=threads, n_threads_batch=threads)
+    
+    @classmethod
+    def for_model(cls, model_path, workers=1, profile_path=PROFILE_PATH):
+        """Settings for a model: detected defaults, then its saved profile, then the environment"""
+        config = cls.detect(workers)
+        profile = load_profile(profile_path).get(os.path.basename(model_path), {}).get(str(workers))
+        if profile is not None and profile.get("machine") != machine_id():
+            print(f"WARNING: runtime profile of {os.path.basename(model_path)} was tuned on other hardware, ignoring it")
+            profile = None
+        if profile is not None:
+            for field in ENV_SETTINGS:
+                if profile.get(field) is not None:
+                    setattr(config, field, profile[field])
+            config.source = "profile"
+        
+        for field, variable in ENV_SETTINGS.items():
+            if os.getenv(variable):
+                setattr(config, field, int(os.getenv(variable)))
+                config.source = "environment" if profile is None else "profile+environment"
+        if os.getenv('LLM_THREADS') and not os.getenv('LLM_THREADS_BATCH'):
+            config.n_threads_batch = config.n_threads
+        config.use_mmap = os.getenv('LLM_USE_MMAP', '1') == '1'
+        config.use_mlock = os.getenv('LLM_USE_MLOCK', '0') == '1'
+        return config
+    
+    def llama_params(self):
+        """Keyword arguments for llama_cpp.Llama"""
+        return {
+            "n_threads": self.n_threads,
+            "n_threads_batch": self.n_threads_batch,
+            "n_batch": self.n_batch,
+            "n_ubatch": self.n_batch,
+            "n_gpu_layers": self.n_gpu_layers,
+            "use_mmap": self.use_mmap,
+            "use_mlock": self.use_mlock,
+        }
+    
+    def describe(self):
+        return dict(self.llama_params(), n_ctx_cap=self.n_ctx, source=self.source)
+
+def load_profile(path=PROFILE_PATH):
+    """{model file: {workers: settings}} saved by autotune"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_profile(model_path, workers, settings, path=PROFILE_PATH):
+    profiles = load_profile(path)
+    profiles.setdefault(os.path.basename(model_path), {})[str(workers)] = settings
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(profiles, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+class Autotuner:
+    """
+    Short benchmarks of one model over thread counts, batch sizes and contexts
+    Coordinate search: decode threads first, then prompt threads and batch
+    size, then the largest context that decodes within 10% of the best speed.
+    Each setting loads a fresh context; with mmap the weights stay in the page
+    cache, so only the first load reads the file.
+    """
+    
+    def __init__(self, model_path, workers=1, quick=False, max_ctx=4096):
+        self.model_path = model_path
+        self.workers = max(1, workers)
+        self.prompt_tokens = 128 if quick else 512
+        self.decode_tokens = 16 if quick else 48
+        self.max_ctx = max_ctx
+        self.base = RuntimeConfig.for_model(model_path, workers, profile_path=os.devnull)
+    
+    def thread_candidates(self):
+        physical, logical = cpu_cores()
+        physical //= self.workers
+        logical //= self.workers
+        candidates = {max(1, physical * share // 4) for share in (1, 2, 3, 4)} | {max(1, logical)}
+        return sorted(candidates)
+    
+    def run(self):
+        print(f"Autotuning {os.path.basename(self.model_path)} for {self.workers} worker(s) on {machine_id()}")
+        decode = {}
+        for threads in self.thread_candidates():
+            decode[threads] = self._measure(n_threads=threads, n_threads_batch=threads, n_batch=512, n_ctx=2048)[1]
+            print(f"  n_threads={threads:<3} decode {decode[threads]:.2f} tokens/s")
+        n_threads = max(decode, key=decode.get)
+        
+        prompt = {}
+        for threads in self.thread_candidates():
+            for n_batch in (128, 256, 512, 1024):
+                prompt[(threads, n_batch)] = self._measure(
+                    n_threads=n_threads, n_threads_batch=threads, n_batch=n_batch, n_ctx=2048, decode=False
+                )[0]
+                print(f"  n_threads_batch={threads:<3} n_batch={n_batch:<5} prompt {prompt[(threads, n_batch)]:.1f} tokens/s")
+        n_threads_batch, n_batch = max(prompt, key=prompt.get)
+        
+        contexts = {}
+        for n_ctx in (1024, 2048, 4096, 8192):
+            if n_ctx > self.max_ctx:
+                break
+            contexts[n_ctx] = self._measure(
+                n_threads=n_threads, n_threads_batch=n_threads_batch, n_batch=n_batch, n_ctx=n_ctx,
+                fill=n_ctx // 2
+            )[1]
+            print(f"  n_ctx={n_ctx:<5} decode {contexts[n_ctx]:.2f} tokens/s with a half-full context")
+        best = max(contexts.values())
+        n_ctx = max(size for size, speed in contexts.items() if speed >= 0.9 * best)
+        
+        return {
+            "n_threads": n_threads,
+            "n_threads_batch": n_threads_batch,
+            "n_batch": n_batch,
+            "n_gpu_layers": self.base.n_gpu_layers,
+            # Only a cap when a larger context decodes noticeably slower
+            "n_ctx": n_ctx if n_ctx < max(contexts) else None,
+            "decode_tokens_per_second": round(decode[n_threads], 2),
+            "prompt_tokens_per_second": round(prompt[(n_threads_batch, n_batch)], 1),
+            "machine": machine_id(),
+            "tuned_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+    
+    def _measure(self, n_threads, n_threads_batch, n_batch, n_ctx, fill=None, decode=True):
+        """(prompt eval tokens/s, decode tokens/s or None) of one setting"""
+        params = dict(self.base.llama_params(), n_threads=n_threads, n_threads_batch=n_threads_batch,
+                      n_batch=n_batch, n_ubatch=n_batch)
+        llm = Llama(model_path=self.model_path, n_ctx=n_ctx, verbose=False, **params)
+        try:
+            text = b" The quick brown fox jumps over the lazy dog, and then it naps in the sun."
+            tokens = llm.tokenize(text * (1 + (fill or self.prompt_tokens) // 16))[:fill or self.prompt_tokens]
+            tokens = tokens[:n_ctx - self.decode_tokens - 1]
+            
+            started = time.perf_counter()
+            llm.eval(tokens)
+            prompt_speed = len(tokens) / (time.perf_counter() - started)
+            if not decode:
+                return prompt_speed, None
+            
+            started = time.perf_counter()
+            for token in tokens[:self.decode_tokens]:
+                llm.eval([token])
+            decode_speed = self.decode_tokens / (time.perf_counter() - started)
+            return prompt_speed, decode_speed
+        finally:
+            llm.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('show', 'autotune'))
+    parser.add_argument('--model', default=os.getenv('MODEL_NAME', 'OpenHermes-2.5-Mistral-7B'),
+                        help="GGUF file in backend/models/ or a path (default: MODEL_NAME)")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('LLM_WORKERS', '1')),
+                        help="LLM workers sharing the CPU (default: LLM_WORKERS)")
+    parser.add_argument('--quick', action='store_true', help="shorter benchmarks")
+    parser.add_argument('--max-ctx', type=int, default=4096, help="largest context size to try")
+    args = parser.parse_args()
+    
+    model_path = args.model
+    if not os.path.exists(model_path):
+        model_path = os.path.join(os.path.dirname(__file__), 'models', args.model)
+    
+    if args.command == 'show':
+        physical, logical = cpu_cores()
+        print(f"CPU: {physical} physical / {logical} logical cores available")
+        print(json.dumps(RuntimeConfig.for_model(model_path, args.workers).describe(), indent=2))
+        return
+    
+    if not os.path.exists(model_path):
+        sys.exit(f"Model file not found: {model_path}")
+    settings = Autotuner(model_path, args.workers, quick=args.quick, max_ctx=args.max_ctx).run()
+    save_profile(model_path, args.workers, settings)
+    print(json.dumps(settings, indent=2))
+    print(f"Saved to {PROFILE_PATH}; the server uses it from the next start")
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,216 @@
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer, BOOSTER_DICT, NEGATE, SPECIAL_CASES
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import multiprocessing
+import string
+import threading
+import numpy as np
+
+from metrics import CACHE_LOOKUPS
+
+# Words that make VADER change a word's valence based on its neighbours
+MODIFIER_WORDS = set(BOOSTER_DICT) | set(NEGATE) | {"no", "but", "least", "kind", "so", "this", "never", "without"}
+# Multi-word phrases VADER looks for (idioms, "kind of", ...)
+MODIFIER_PHRASES = {phrase for phrase in list(BOOSTER_DICT) + list(SPECIAL_CASES) if ' ' in phrase}
 
 class SentimentAnalyzer:
-    def __init__(self):
+    def __init__(self, cache_size=4096, pool_workers=0):
+        """
+        cache_size bounds the analyze() results kept for repeated texts (0 = no cache)
+        pool_workers > 1 starts a long-lived process pool that analyze_batch
+        uses instead of creating one per call
+        """
         self.analyzer = SentimentIntensityAnalyzer()
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # text digest -> result, least recently used first
+        self._cache_lock = threading.Lock()
+        
+        # Sorted lexicon arrays for bulk lookups with np.searchsorted
+        words = sorted(self.analyzer.lexicon)
+        self.lexicon_words = np.array(words)
+        self.lexicon_valences = np.array([self.analyzer.lexicon[w] for w in words], dtype=np.float64)
+        
+        self.pool_workers = pool_workers
+        self.pool = None
+        if pool_workers > 1:
+            self.pool = self._start_pool(pool_workers)
     
     def analyze(self, text):
         """
         Analyze sentiment of the given text
         Returns: dict with scores and classification
+        Results are cached by a hash of the text; callers get their own copy
+        """
+        key = hashlib.sha1(text.encode('utf-8', 'surrogatepass')).digest()
+        with self._cache_lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+        CACHE_LOOKUPS.inc(cache='sentiment', result='miss' if result is None else 'hit')
+        
+        if result is None:
+            result = self._classify(self.analyzer.polarity_scores(text))
+            if self.cache_size > 0:
+                with self._cache_lock:
+                    self._cache[key] = result
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+        return dict(result, scores=dict(result['scores']))
+    
+    def analyze_batch(self, texts, workers=None):
+        """
+        Analyze many texts at once
+        Texts without negations, boosters, idioms or emphasis capitals are scored
+        with vectorized lexicon lookups; the rest go through VADER as usual.
+        workers > 1 spreads the batch over that many processes: the pool started
+        with pool_workers (at most its size), else a pool just for this call.
+        Returns: list of dicts in the same format as analyze
         """
-        scores = self.analyzer.polarity_scores(text)
+        texts = list(texts)
+        if self.pool is not None and workers:
+            workers = min(workers, self.pool_workers)
+        if workers and workers > 1 and len(texts) > workers:
+            chunk_size = (len(texts) + workers - 1) // workers
+            chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+            if self.pool is not None:
+                return [result for chunk in self.pool.map(_analyze_chunk, chunks) for result in chunk]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                return [result for chunk in pool.map(_analyze_chunk, chunks) for result in chunk]
         
+        results = [None] * len(texts)
+        simple_indices = []
+        simple_tokens = []
+        
+        for index, text in enumerate(texts):
+            tokens = self._simple_tokens(text)
+            if tokens is None:
+                results[index] = self._classify(self.analyzer.polarity_scores(text))
+            else:
+                simple_indices.append(index)
+                simple_tokens.append(tokens)
+        
+        if simple_indices:
+            scores = self._score_simple([texts[i] for i in simple_indices], simple_tokens)
+            for index, text_scores in zip(simple_indices, scores):
+                results[index] = self._classify(text_scores)
+        
+        return results
+    
+    def _start_pool(self, workers):
+        """
+        Process pool for analyze_batch, started right away
+        Where fork is available the processes are forked now, while the caller
+        (e.g. the server at import) has no other threads yet, and inherit this
+        analyzer instead of each building their own.
+        """
+        global _worker_analyzer
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            return ProcessPoolExecutor(max_workers=workers)
+        
+        _worker_analyzer = self
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+        # Forking happens on the first submit
+        list(pool.map(_analyze_chunk, [[]] * workers))
+        return pool
+    
+    def _simple_tokens(self, text):
+        """
+        Tokenize like VADER and return lowercase tokens, or None when the text
+        needs VADER's context rules (emoji, modifiers, idioms, ALL CAPS words)
+        """
+        if not isinstance(text, str) or not text.isascii():
+            return None
+        
+        words = text.strip().split()
+        tokens = []
+        for word in words:
+            # Same as SentiText._strip_punc_if_word
+            stripped = word.strip(string.punctuation)
+            if len(stripped) > 2:
+                word = stripped
+            lowered = word.lower()
+            if lowered in MODIFIER_WORDS or "n't" in lowered:
+                return None
+            if word.isupper() and lowered in self.analyzer.lexicon:
+                return None
+            tokens.append(lowered)
+        
+        for n in (2, 3):
+            for i in range(len(tokens) - n + 1):
+                if " ".join(tokens[i:i + n]) in MODIFIER_PHRASES:
+                    return None
+        
+        return tokens
+    
+    def _score_simple(self, texts, token_lists):
+        """Vectorized VADER scores for texts where every word keeps its lexicon valence"""
+        counts = np.array([len(tokens) for tokens in token_lists])
+        all_tokens = np.array([token for tokens in token_lists for token in tokens] or [""])
+        
+        # Bulk lexicon lookup
+        positions = np.searchsorted(self.lexicon_words, all_tokens)
+        positions = np.minimum(positions, len(self.lexicon_words) - 1)
+        found = self.lexicon_words[positions] == all_tokens
+        valences = np.where(found, self.lexicon_valences[positions], 0.0)[:counts.sum()]
+        
+        # Per-text sums over each text's slice of the token array
+        has_tokens = counts > 0
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[has_tokens]
+        
+        def per_text_sum(values):
+            sums = np.zeros(len(counts))
+            if len(starts):
+                sums[has_tokens] = np.add.reduceat(values, starts)
+            return sums
+        
+        sum_s = per_text_sum(valences)
+        pos_sum = per_text_sum(np.where(valences > 0, valences + 1, 0.0))
+        neg_sum = per_text_sum(np.where(valences < 0, valences - 1, 0.0))
+        neu_count = per_text_sum((valences == 0).astype(np.float64))
+        
+        # Near a tie the sign depends on summation order, so redo those texts
+        # with the same left-to-right float sums VADER uses
+        ties = np.flatnonzero(has_tokens & ((np.abs(sum_s) < 1e-9) | (np.abs(pos_sum + neg_sum) < 1e-9)))
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        for i in ties:
+            text_valences = valences[offsets[i]:offsets[i + 1]].tolist()
+            sum_s[i] = sum(text_valences)
+            pos_sum[i] = 0.0
+            neg_sum[i] = 0.0
+            for valence in text_valences:
+                if valence > 0:
+                    pos_sum[i] += valence + 1
+                if valence < 0:
+                    neg_sum[i] += valence - 1
+        
+        # Punctuation emphasis (VADER _amplify_ep / _amplify_qm)
+        exclamations = np.minimum([text.count("!") for text in texts], 4)
+        questions = np.array([text.count("?") for text in texts])
+        qm_amplifier = np.where(questions > 3, 0.96, np.where(questions > 1, questions * 0.18, 0.0))
+        amplifier = exclamations * 0.292 + qm_amplifier
+        
+        sum_s = sum_s + np.sign(sum_s) * amplifier
+        compound = np.clip(sum_s / np.sqrt(sum_s * sum_s + 15), -1.0, 1.0)
+        
+        positive_wins = pos_sum > np.abs(neg_sum)
+        negative_wins = pos_sum < np.abs(neg_sum)
+        pos_sum = pos_sum + np.where(positive_wins, amplifier, 0.0)
+        neg_sum = neg_sum - np.where(negative_wins, amplifier, 0.0)
+        total = pos_sum + np.abs(neg_sum) + neu_count
+        safe_total = np.where(total > 0, total, 1.0)
+        
+        pos = np.where(has_tokens, np.abs(pos_sum / safe_total), 0.0)
+        neg = np.where(has_tokens, np.abs(neg_sum / safe_total), 0.0)
+        neu = np.where(has_tokens, np.abs(neu_count / safe_total), 0.0)
+        compound = np.where(has_tokens, compound, 0.0)
+        
+        return [
+            {"neg": round(n, 3), "neu": round(u, 3), "pos": round(p, 3), "compound": round(c, 4)}
+            for n, u, p, c in zip(neg.tolist(), neu.tolist(), pos.tolist(), compound.tolist())
+        ]
+    
+    def _classify(self, scores):
         # Classify sentiment
         compound = scores['compound']
         if compound >= 0.05:
@@ -42,4 +242,13 @@ class SentimentAnalyzer:
                 return "very_negative"
             return "negative"
         else:
-            return "neutral"
\ No newline at end of file
+            return "neutral"
+
+_worker_analyzer = None
+
+def _analyze_chunk(texts):
+    """Process pool entry point; each worker process builds its analyzer once"""
+    global _worker_analyzer
+    if _worker_analyzer is None:
+        _worker_analyzer = SentimentAnalyzer()
+    return _worker_analyzer.analyze_batch(texts)
@@ -1,8 +1,23 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from sentiment_analyzer import SentimentAnalyzer
 from llm_handler import LLMHandler
+from inference_scheduler import QueueFullError, DeadlineExceededError
+from model_loader import ModelLoader, ModelNotReadyError
+from model_registry import ModelRegistry, ModelSpec
+from runtime_config import RuntimeConfig
+from download_model import MODELS
+from chat_templates import get_chat_template
+from response_cache import ResponseCache
+from session_store import Session, SessionStore
+from mood_tracker import MoodTracker
+from request_coalescer import IdempotencyKeyReusedError, RequestCoalescer
+from metrics import registry, debug_log, Gauge, REQUEST_SECONDS, MODEL_REQUESTS, STAGE_SECONDS
+import functools
+import hmac
 import os
+import json
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -12,11 +27,19 @@ app = Flask(__name__)
 CORS(app)  # Enable CORS for frontend communication
 
 # Initialize components
-sentiment_analyzer = SentimentAnalyzer()
+# Analysis results of repeated texts are cached
+# Processes for /api/sentiment/batch requests asking for workers > 1, started once here
+# before any other thread exists (0 = score every batch in the request thread)
+SENTIMENT_BATCH_WORKERS = min(int(os.getenv('SENTIMENT_BATCH_WORKERS', '0')), os.cpu_count() or 1)
+sentiment_analyzer = SentimentAnalyzer(
+    cache_size=int(os.getenv('SENTIMENT_CACHE_SIZE', '4096')),
+    pool_workers=SENTIMENT_BATCH_WORKERS
+)
 
 # Path to your GGUF model - now reads from .env
 MODEL_NAME = os.getenv('MODEL_NAME', 'OpenHermes-2.5-Mistral-7B')
-MODEL_PATH = os.path.join(os.path.dirname(__file__), 'models', MODEL_NAME)
+MODELS_DIR = os.path.join(os.path.dirname(__file__), 'models')
+MODEL_PATH = os.path.join(MODELS_DIR, MODEL_NAME)
 
 # Check if model exists
 if not os.path.exists(MODEL_PATH):
@@ -26,71 +49,498 @@ if not os.path.exists(MODEL_PATH):
     print(f"Expected location: {MODEL_PATH}")
     print("\nPlease run the model downloader first:")
     print("  python download_model.py")
+    print("\nThe server keeps running; chat endpoints report not ready until restarted")
     print("="*60 + "\n")
-    exit(1)
 
-print(f"\nLoading model: {MODEL_NAME}")
-print(f"Path: {MODEL_PATH}")
-llm_handler = LLMHandler(MODEL_PATH)
+# Worker pool settings - each worker holds its own llama.cpp context
+LLM_WORKERS = int(os.getenv('LLM_WORKERS', '1'))
+LLM_QUEUE_SIZE = int(os.getenv('LLM_QUEUE_SIZE', '16'))
+LLM_REQUEST_TIMEOUT = float(os.getenv('LLM_REQUEST_TIMEOUT', '60'))
+# Memory budget per worker for per-session KV-cache snapshots
+KV_CACHE_MB = int(os.getenv('KV_CACHE_MB', '512'))
+# Sequences decoded together in one batch (0 = one context per worker, no batching)
+LLM_BATCH_SLOTS = int(os.getenv('LLM_BATCH_SLOTS', '0'))
+# Run one short generation before reporting ready
+LLM_WARMUP = os.getenv('LLM_WARMUP', '1') == '1'
+# Cap on history tokens per prompt (0 = fill the context window)
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '0'))
 
-# Store conversation history (in production, use a database)
-conversation_sessions = {}
+# Default chat model (MODEL_NAME) settings; catalog files get theirs from download_model.MODELS
+MODEL_CATALOG = {model['filename']: model for model in MODELS.values()}
+MODEL_CHAT_TEMPLATE = os.getenv('MODEL_CHAT_TEMPLATE') or MODEL_CATALOG.get(MODEL_NAME, {}).get('chat_template', 'chatml')
+MODEL_CONTEXT = int(os.getenv('MODEL_CONTEXT') or MODEL_CATALOG.get(MODEL_NAME, {}).get('n_ctx', 4096))
+# More models from download_model.MODELS that requests can be routed to, e.g. "tinyllama,llama3"
+EXTRA_MODELS = [key.strip() for key in os.getenv('MODELS', '').split(',') if key.strip()]
+# Sentiment tone -> model, e.g. "neutral=tinyllama,positive=tinyllama"; other tones use the default model
+MODEL_ROUTES = dict(
+    route.strip().split('=', 1) for route in os.getenv('MODEL_ROUTES', '').split(',') if '=' in route
+)
+# Memory for loaded model weights (0 = no limit); least recently used extra models are unloaded
+MODEL_MEMORY_MB = int(os.getenv('MODEL_MEMORY_MB', '0'))
+# Small model drafting tokens for MODEL_NAME (speculative decoding), e.g. the TinyLlama file; unset = off
+DRAFT_MODEL_NAME = os.getenv('DRAFT_MODEL_NAME')
+DRAFT_MODEL_PATH = os.path.join(MODELS_DIR, DRAFT_MODEL_NAME) if DRAFT_MODEL_NAME else None
+# Tokens the draft model proposes per step
+DRAFT_TOKENS = int(os.getenv('DRAFT_TOKENS', '6'))
+# Token for the model admin endpoints (unset = disabled)
+MODEL_ADMIN_TOKEN = os.getenv('MODEL_ADMIN_TOKEN')
+
+# How long a shutdown or model swap waits for in-flight generations before stopping the workers
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv('SHUTDOWN_DRAIN_SECONDS', str(LLM_REQUEST_TIMEOUT)))
+
+if LLM_BATCH_SLOTS > 0:
+    LLM_WORKERS = LLM_BATCH_SLOTS
+
+def catalog_spec(key):
+    """ModelSpec of a download_model.MODELS entry"""
+    model = MODELS[key]
+    return ModelSpec(key, os.path.join(MODELS_DIR, model['filename']), model['chat_template'], model['n_ctx'])
+
+def handler_factory(spec):
+    """LLMHandler factory for the workers of one model"""
+    # Threads etc. from LLM_* settings, the autotune profile or the detected cores;
+    # the batch engine's single context gets every core
+    runtime = RuntimeConfig.for_model(spec.path, workers=1 if LLM_BATCH_SLOTS > 0 else LLM_WORKERS)
+    
+    def create_handler():
+        return LLMHandler(
+            spec.path,
+            kv_cache_bytes=KV_CACHE_MB * 1024 * 1024,
+            batch_slots=LLM_BATCH_SLOTS,
+            runtime=runtime,
+            history_tokens=HISTORY_TOKEN_BUDGET,
+            chat_template=spec.chat_template,
+            n_ctx=spec.n_ctx,
+            draft_model_path=spec.draft_path,
+            draft_tokens=DRAFT_TOKENS
+        )
+    
+    if LLM_BATCH_SLOTS > 0:
+        # One batched context serves every worker; each worker feeds it one sequence
+        return functools.lru_cache(maxsize=None)(create_handler)
+    return create_handler
+
+def model_loader_factory(spec):
+    return ModelLoader(
+        spec.path,
+        handler_factory(spec),
+        num_workers=LLM_WORKERS,
+        scheduler_options={"max_queue_size": LLM_QUEUE_SIZE, "request_timeout": LLM_REQUEST_TIMEOUT},
+        warm_up=LLM_WARMUP
+    )
+
+model_specs = [ModelSpec('default', MODEL_PATH, MODEL_CHAT_TEMPLATE, MODEL_CONTEXT, DRAFT_MODEL_PATH)]
+for key in EXTRA_MODELS:
+    if key in MODELS:
+        model_specs.append(catalog_spec(key))
+    else:
+        print(f"WARNING: unknown model '{key}' in MODELS (known: {', '.join(MODELS)})")
+
+# The default model loads in the background so the server starts answering right away;
+# routed models load on first use
+model_registry = ModelRegistry(
+    model_loader_factory,
+    model_specs,
+    default_key='default',
+    routes=MODEL_ROUTES,
+    memory_budget=MODEL_MEMORY_MB * 1024 * 1024,
+    drain_timeout=SHUTDOWN_DRAIN_SECONDS
+)
+model_registry.start()
+
+def scheduler_gauge(read):
+    """Gauge function summing over the schedulers of the loaded models"""
+    return lambda: sum(read(scheduler) for scheduler in model_registry.schedulers())
+
+registry.register(Gauge(
+    "sleepyhead_queue_depth", "Chat requests waiting for an LLM worker",
+    function=scheduler_gauge(lambda scheduler: scheduler.queue_depth)
+))
+registry.register(Gauge(
+    "sleepyhead_active_generations", "Chat requests being generated",
+    function=scheduler_gauge(lambda scheduler: scheduler.active_jobs)
+))
+
+# Fraction of chat requests whose message, prompt and reply are printed (0 = none)
+debug_log.rate = float(os.getenv('DEBUG_LOG_SAMPLE_RATE', '0'))
+
+# Replies for repeated short messages ("hi", "I'm tired") - RESPONSE_CACHE_SIZE=0 disables it
+response_cache = ResponseCache(
+    max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('RESPONSE_CACHE_TTL', '600')),
+    variants=int(os.getenv('RESPONSE_CACHE_VARIANTS', '1'))
+)
+
+# Conversation history per session_id; SESSION_DB keeps it in SQLite across restarts
+session_store = SessionStore(
+    max_sessions=int(os.getenv('SESSION_MAX', '1000')),
+    ttl=float(os.getenv('SESSION_TTL', '3600')),
+    max_turns=int(os.getenv('SESSION_MAX_TURNS', '200')),
+    db_path=os.getenv('SESSION_DB') or None
+)
+
+# Duplicate /api/chat requests share one generation; results stay around for retries
+request_coalescer = RequestCoalescer(ttl=float(os.getenv('REQUEST_COALESCE_TTL', '60')))
+
+# Rolling mood per session_id for /api/sentiment/summary
+mood_tracker = MoodTracker(max_sessions=session_store.max_sessions)
+
+def busy_response(error):
+    """503 response telling the client when to retry"""
+    body = {"error": str(error), "retry_after": error.retry_after}
+    if isinstance(error, ModelNotReadyError):
+        body["model"] = model_registry.default_status()
+    response = jsonify(body)
+    response.status_code = 503
+    if error.retry_after is not None:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def chat_session(data):
+    """
+    History for a chat request
+    Older clients send the whole conversation_history; those get a throwaway
+    session built from it. Otherwise the stored session for session_id is used,
+    and requests without a session_id get an empty throwaway session.
+    Returns: (session, whether the session is stored server-side)
+    """
+    session_id = data.get('session_id') or None
+    conversation_history = data.get('conversation_history')
+    if isinstance(conversation_history, list):
+        return Session.from_messages(session_id, conversation_history), False
+    if session_id is None:
+        return Session(None), False
+    return session_store.get(session_id), True
+
+def record_turn(session, stored, user_message, response):
+    """Add an exchange to the stored session (client-sent histories are not kept)"""
+    if stored:
+        session_store.append(session.session_id, 'user', user_message)
+        session_store.append(session.session_id, 'bot', response)
+
+def request_timeout(data):
+    """
+    Client-requested timeout in seconds, capped at LLM_REQUEST_TIMEOUT; None if not sent
+    Raises ValueError for anything that is not a positive number
+    """
+    timeout = data.get('timeout')
+    if timeout is None:
+        return None
+    try:
+        seconds = float(timeout)
+    except (TypeError, ValueError):
+        seconds = None
+    # float() accepts booleans; NaN fails the > 0 check
+    if isinstance(timeout, bool) or seconds is None or not seconds > 0:
+        raise ValueError("timeout must be a positive number of seconds")
+    return min(seconds, LLM_REQUEST_TIMEOUT)
+
+def analyze_message(user_message):
+    """Sentiment, response tone and language of a chat message; the language is detected once per request"""
+    with STAGE_SECONDS.time(stage='sentiment'):
+        sentiment_result = sentiment_analyzer.analyze(user_message)
+        tone = sentiment_analyzer.get_response_tone(sentiment_result)
+    return sentiment_result, tone, LLMHandler.detect_language(user_message)
+
+def cache_reply(cache_key, model, tone, response):
+    """Cache a generated reply, unless a swap or load changed the model answering the tone meanwhile"""
+    if model_registry.serving(tone) == model:
+        response_cache.put(cache_key, response)
+
+def submit_chat(user_message, tone, language, session, timeout=None):
+    """Queue a chat generation on the worker pool of the model routed to for the tone"""
+    model_key, scheduler = model_registry.get_scheduler(tone)
+    MODEL_REQUESTS.inc(model=model_key)
+    return scheduler.submit(
+        lambda handler: handler.generate_response_stream(
+            user_message=user_message,
+            tone=tone,
+            session=session,
+            language=language
+        ),
+        timeout=timeout
+    )
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({"status": "healthy", "message": "SleepyHead backend is running"})
+    return jsonify({
+        "status": "healthy",
+        "message": "SleepyHead backend is running",
+        "model": model_registry.default_status(),
+        "models": model_registry.status(),
+        "sessions": session_store.stats(),
+        "response_cache": response_cache.stats()
+    })
+
+@app.route('/health/live', methods=['GET'])
+def liveness_check():
+    """Liveness probe: the process is up and serving requests"""
+    return jsonify({"status": "alive"})
+
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 200 once the model is loaded and warmed up, 503 before that"""
+    status = model_registry.default_status()
+    return jsonify({"ready": model_registry.ready, "model": status}), 200 if model_registry.ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics: per-stage latency, token counts, fallback rate, queue depth, cache hits"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+def chat_reply(user_message, session, stored, timeout):
+    """Sentiment analysis and reply for one /api/chat request; returns the response body"""
+    # Step 1: Perform sentiment analysis
+    sentiment_result, tone, language = analyze_message(user_message)
+    
+    log_details = debug_log.sampled()
+    if log_details:
+        debug_log.log("CHAT REQUEST", (
+            f"User message: {user_message}\n"
+            f"Sentiment: {sentiment_result['sentiment']}, Compound: {sentiment_result['compound']:.3f}\n"
+            f"Response tone: {tone}"
+        ))
+    
+    # Step 2: Reuse a cached reply, or generate one using LLM based on sentiment
+    model = model_registry.serving(tone)
+    cache_key = response_cache.make_key(user_message, language, tone, session.context_turns, model)
+    response = response_cache.get(cache_key)
+    cached = response is not None
+    if not cached:
+        job = submit_chat(user_message, tone, language, session, timeout)
+    # Only messages the server accepted count toward the mood, not ones turned away with a 503
+    mood_tracker.record(session.session_id, sentiment_result, tone)
+    if not cached:
+        response = job.result()['response']
+        cache_reply(cache_key, model, tone, response)
+    record_turn(session, stored, user_message, response)
+    
+    if log_details:
+        debug_log.log("CHAT RESPONSE", f"{'Cached' if cached else 'Generated'} response: {response}")
+    
+    # Response with sentiment data
+    return {
+        "response": response,
+        "sentiment": {
+            "classification": sentiment_result['sentiment'],
+            "scores": sentiment_result['scores'],
+            "tone": tone
+        }
+    }
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """
     Main chat endpoint
     Receives user message, performs sentiment analysis, and generates response
+    A duplicate of a request that is still running (same session, message and
+    history, or same Idempotency-Key header) waits for that request's reply
+    instead of generating its own. Retries with the same Idempotency-Key within
+    REQUEST_COALESCE_TTL get it too; the key with another message is a 422.
     """
     try:
+        started = time.perf_counter()
         data = request.json
         user_message = data.get('message', '')
-        session_id = data.get('session_id', 'default')
-        conversation_history = data.get('conversation_history', [])
         
         if not user_message:
             return jsonify({"error": "Message is required"}), 400
+        try:
+            timeout = request_timeout(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        # Step 1: Perform sentiment analysis
-        sentiment_result = sentiment_analyzer.analyze(user_message)
-        tone = sentiment_analyzer.get_response_tone(sentiment_result)
-        
-        print(f"\n{'='*60}")
-        print(f"User message: {user_message}")
-        print(f"Sentiment: {sentiment_result['sentiment']}, Compound: {sentiment_result['compound']:.3f}")
-        print(f"Response tone: {tone}")
-        
-        # Step 2: Generate response using LLM based on sentiment
-        print(f"Generating response...")
-        response = llm_handler.generate_response(
-            user_message=user_message,
-            tone=tone,
-            conversation_history=conversation_history
+        session, stored = chat_session(data)
+        idempotency_key = request.headers.get('Idempotency-Key')
+        coalesce_key = request_coalescer.make_key(session.session_id, user_message, session.turns, idempotency_key)
+        body, _ = request_coalescer.run(
+            coalesce_key, lambda: chat_reply(user_message, session, stored, timeout), message=user_message
         )
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint='chat')
         
-        print(f"Generated response: {response}")
-        print(f"{'='*60}\n")
+        return jsonify(body)
+    
+    except (QueueFullError, ModelNotReadyError) as e:
+        return busy_response(e)
+    
+    except DeadlineExceededError as e:
+        return jsonify({"error": str(e)}), 504
+    
+    except IdempotencyKeyReusedError as e:
+        return jsonify({"error": str(e)}), 422
+    
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Streaming chat endpoint
+    Same request body as /api/chat, but the reply is sent as Server-Sent Events:
+    'token' events while the model generates, then one 'done' event with the
+    final response and sentiment data
+    """
+    started = time.perf_counter()
+    data = request.json or {}
+    user_message = data.get('message', '')
+    
+    if not user_message:
+        return jsonify({"error": "Message is required"}), 400
+    try:
+        timeout = request_timeout(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        session, stored = chat_session(data)
         
-        # Return response with sentiment data
-        return jsonify({
-            "response": response,
-            "sentiment": {
-                "classification": sentiment_result['sentiment'],
-                "scores": sentiment_result['scores'],
-                "tone": tone
-            }
-        })
+        sentiment_result, tone, language = analyze_message(user_message)
+        sentiment = {
+            "classification": sentiment_result['sentiment'],
+            "scores": sentiment_result['scores'],
+            "tone": tone
+        }
+        
+        model = model_registry.serving(tone)
+        cache_key = response_cache.make_key(user_message, language, tone, session.context_turns, model)
+        cached = response_cache.get(cache_key)
+        job = submit_chat(user_message, tone, language, session, timeout) if cached is None else None
+        # Only messages the server accepted count toward the mood, not ones turned away with a 503
+        mood_tracker.record(session.session_id, sentiment_result, tone)
+        if cached is not None:
+            record_turn(session, stored, user_message, cached)
+    
+    except (QueueFullError, ModelNotReadyError) as e:
+        return busy_response(e)
     
     except Exception as e:
         print(f"Error: {str(e)}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
+    
+    if cached is not None:
+        def generate_cached():
+            yield sse_event('token', {"text": cached})
+            yield sse_event('done', {"response": cached, "replaced": False, "sentiment": sentiment})
+            REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint='chat_stream')
+        
+        return Response(generate_cached(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+    
+    def generate():
+        try:
+            for event in job.events():
+                if event['type'] == 'token':
+                    yield sse_event('token', {"text": event['text']})
+                else:
+                    cache_reply(cache_key, model, tone, event['response'])
+                    record_turn(session, stored, user_message, event['response'])
+                    yield sse_event('done', {
+                        "response": event['response'],
+                        "replaced": event['replaced'],
+                        "sentiment": sentiment
+                    })
+                    REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint='chat_stream')
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            yield sse_event('error', {"error": str(e)})
+        finally:
+            # Client disconnected or stream finished - free the worker either way
+            job.cancel()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/api/session/<session_id>', methods=['DELETE'])
+def clear_session(session_id):
+    """Forget the stored history and mood of a session"""
+    session_store.clear(session_id)
+    mood_tracker.clear(session_id)
+    return jsonify({"cleared": session_id})
+
+def admin_denied():
+    """Error response unless the request carries MODEL_ADMIN_TOKEN; None when allowed"""
+    if not MODEL_ADMIN_TOKEN:
+        return jsonify({"error": "Model admin is disabled (set MODEL_ADMIN_TOKEN)"}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), MODEL_ADMIN_TOKEN):
+        return jsonify({"error": "Invalid admin token"}), 401
+    return None
+
+@app.route('/api/models', methods=['GET'])
+def list_models():
+    """Registered models, their load state, routes and memory use"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    return jsonify(model_registry.status())
+
+@app.route('/api/models/<key>', methods=['PUT'])
+def swap_model(key):
+    """
+    Load or reload a model without downtime
+    Body (all optional): {"file": GGUF file name in backend/models, "chat_template", "n_ctx"}.
+    Without a body the model's current file is reloaded, e.g. after replacing it on disk.
+    """
+    denied = admin_denied()
+    if denied:
+        return denied
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "Body must be a JSON object"}), 400
+    current = model_registry.specs.get(key) or (catalog_spec(key) if key in MODELS else None)
+    
+    filename = data.get('file')
+    if filename is None and current is None:
+        return jsonify({"error": f"Unknown model '{key}', send a file"}), 404
+    if filename is not None and (
+        not isinstance(filename, str) or os.path.basename(filename) != filename or not filename.endswith('.gguf')
+    ):
+        return jsonify({"error": "file must be a .gguf file name in the models directory"}), 400
+    path = os.path.join(MODELS_DIR, filename) if filename is not None else current.path
+    if not os.path.exists(path):
+        return jsonify({"error": f"Model file not found: {os.path.basename(path)}"}), 404
+    
+    chat_template = data.get('chat_template') or (current.chat_template if current else 'chatml')
+    if not isinstance(chat_template, str):
+        return jsonify({"error": "chat_template must be a template name"}), 400
+    try:
+        get_chat_template(chat_template)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        n_ctx = int(data.get('n_ctx') or (current.n_ctx if current else 4096))
+    except (TypeError, ValueError):
+        n_ctx = 0
+    if isinstance(data.get('n_ctx'), bool) or n_ctx <= 0:
+        return jsonify({"error": "n_ctx must be a positive integer"}), 400
+    
+    model_registry.swap(key, ModelSpec(key, path, chat_template, n_ctx, current.draft_path if current else None))
+    return jsonify(model_registry.status()["models"][key]), 202
+
+@app.route('/api/models/<key>', methods=['DELETE'])
+def unload_model(key):
+    """Unload a model once its in-flight requests finish; the default model stays"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    if key not in model_registry.specs:
+        return jsonify({"error": f"Unknown model '{key}'"}), 404
+    try:
+        model_registry.unload(key)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"unloaded": key})
 
 @app.route('/api/sentiment', methods=['POST'])
 def analyze_sentiment():
@@ -106,6 +556,9 @@ def analyze_sentiment():
         
         result = sentiment_analyzer.analyze(text)
         tone = sentiment_analyzer.get_response_tone(result)
+        # Mood tracker entries that are not chat messages send their session_id
+        if data.get('session_id'):
+            mood_tracker.record(data['session_id'], result, tone)
         
         return jsonify({
             "sentiment": result['sentiment'],
@@ -116,7 +569,61 @@ def analyze_sentiment():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/sentiment/summary', methods=['GET'])
+def sentiment_summary():
+    """
+    Rolling mood stats: mean compound, tone distribution and trend
+    ?session_id=... for one session, otherwise over all sessions
+    """
+    session_id = request.args.get('session_id')
+    summary = mood_tracker.summary(session_id)
+    if summary is None:
+        return jsonify({"error": f"No sentiment recorded for session '{session_id}'"}), 404
+    return jsonify(summary)
+
+# Upper limit on texts per /api/sentiment/batch request
+MAX_SENTIMENT_BATCH = int(os.getenv('MAX_SENTIMENT_BATCH', '10000'))
+
+@app.route('/api/sentiment/batch', methods=['POST'])
+def analyze_sentiment_batch():
+    """
+    Analyze many texts in one request (e.g. reprocessing journal history)
+    Body: {"texts": [...], "workers": optional process count, at most SENTIMENT_BATCH_WORKERS}
+    """
+    try:
+        data = request.json or {}
+        texts = data.get('texts', [])
+        
+        if not isinstance(texts, list) or not texts:
+            return jsonify({"error": "texts must be a non-empty list"}), 400
+        if len(texts) > MAX_SENTIMENT_BATCH:
+            return jsonify({"error": f"At most {MAX_SENTIMENT_BATCH} texts per request"}), 400
+        if not all(isinstance(text, str) for text in texts):
+            return jsonify({"error": "texts must be strings"}), 400
+        
+        workers = data.get('workers', 1)
+        if isinstance(workers, bool) or not isinstance(workers, int) or workers < 1:
+            return jsonify({"error": "workers must be a positive integer"}), 400
+        # Only the processes started with the server are used, never new ones per request
+        workers = min(workers, SENTIMENT_BATCH_WORKERS) if sentiment_analyzer.pool is not None else 1
+        results = sentiment_analyzer.analyze_batch(texts, workers=workers)
+        
+        return jsonify({
+            "results": [
+                {
+                    "sentiment": result['sentiment'],
+                    "scores": result['scores'],
+                    "tone": sentiment_analyzer.get_response_tone(result)
+                }
+                for result in results
+            ]
+        })
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == '__main__':
     print("Starting SleepyHead backend server...")
     print(f"Model path: {MODEL_PATH}")
-    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+    # Development server - for production run the ASGI app instead: uvicorn asgi:app
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '5001')), debug=os.getenv('FLASK_DEBUG', '1') == '1')
\ No newline at end of file
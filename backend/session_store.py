@@ -0,0 +1,140 @@
+from collections import OrderedDict
+import sqlite3
+import threading
+import time
+
+class Turn:
+    """One chat message; tokens holds its token ids per model, filled in by each LLMHandler on first use"""
+    
+    __slots__ = ('role', 'text', 'tokens')
+    
+    def __init__(self, role, text, tokens=None):
+        self.role = role  # 'user' or 'bot', same as the frontend message types
+        self.text = text
+        self.tokens = tokens if tokens is not None else {}
+
+class Session:
+    """
+    Conversation history of one session_id
+    context_start is the first turn that still goes into the prompt; the
+    LLMHandler moves it forward when the history outgrows the context window
+    """
+    
+    __slots__ = ('session_id', 'turns', 'context_start', 'last_access')
+    
+    def __init__(self, session_id, turns=None):
+        self.session_id = session_id
+        self.turns = turns or []
+        self.context_start = 0
+        self.last_access = time.monotonic()
+    
+    @property
+    def context_turns(self):
+        """The turns from context_start on; prompts include these or a later part of them"""
+        return self.turns[self.context_start:]
+    
+    @classmethod
+    def from_messages(cls, session_id, messages):
+        """Session for a client-sent conversation_history ([{'type': ..., 'text': ...}])"""
+        return cls(session_id, [
+            Turn(message['type'], message['text'])
+            for message in messages
+            if isinstance(message, dict) and message.get('type') in ('user', 'bot') and message.get('text')
+        ])
+
+class SessionStore:
+    """
+    Server-side chat history keyed by session_id
+    Sessions live in memory (LRU, expiring after ttl seconds without use) so
+    their turns keep the token ids cached by the handler. With db_path every
+    turn is also written to SQLite, and sessions evicted from memory or lost on
+    restart are loaded back from there.
+    """
+    
+    def __init__(self, max_sessions=1000, ttl=3600, max_turns=200, db_path=None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                "session_id TEXT NOT NULL, position INTEGER NOT NULL, role TEXT NOT NULL, "
+                "text TEXT NOT NULL, created REAL NOT NULL, PRIMARY KEY (session_id, position))"
+            )
+            self._db.commit()
+    
+    def get(self, session_id):
+        """Return the session, loading or creating it as needed"""
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = Session(session_id, self._load_turns(session_id))
+                self._sessions[session_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            
+            self._sessions.move_to_end(session_id)
+            session.last_access = time.monotonic()
+            return session
+    
+    def append(self, session_id, role, text):
+        """Add a turn to the end of a session"""
+        session = self.get(session_id)
+        with self._lock:
+            session.turns.append(Turn(role, text))
+            
+            # Oldest turns go first once a session is over max_turns
+            dropped = len(session.turns) - self.max_turns
+            if dropped > 0:
+                del session.turns[:dropped]
+                session.context_start = max(0, session.context_start - dropped)
+            
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT INTO turns (session_id, position, role, text, created) "
+                    "SELECT ?, COALESCE(MAX(position) + 1, 0), ?, ?, ? FROM turns WHERE session_id = ?",
+                    (session_id, role, text, time.time(), session_id)
+                )
+                if dropped > 0:
+                    self._db.execute(
+                        "DELETE FROM turns WHERE session_id = ? AND position <= "
+                        "(SELECT MAX(position) FROM turns WHERE session_id = ?) - ?",
+                        (session_id, session_id, self.max_turns)
+                    )
+                self._db.commit()
+    
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+                self._db.commit()
+    
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "backend": "sqlite" if self._db is not None else "memory"
+        }
+    
+    def _expire(self):
+        now = time.monotonic()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_access <= self.ttl:
+                break
+            del self._sessions[session_id]
+    
+    def _load_turns(self, session_id):
+        if self._db is None:
+            return []
+        rows = self._db.execute(
+            "SELECT role, text FROM turns WHERE session_id = ? ORDER BY position DESC LIMIT ?",
+            (session_id, self.max_turns)
+        ).fetchall()
+        return [Turn(role, text) for role, text in reversed(rows)]
@@ -0,0 +1,103 @@
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel
+import numpy as np
+
+from kv_cache import common_prefix_length
+from metrics import DRAFT_TOKENS
+
+# Target tokens re-tokenized together with a draft to find where the draft starts
+TAIL_TOKENS = 8
+
+class SmallModelDraft(LlamaDraftModel):
+    """
+    Speculative decoding drafts from a small model (e.g. TinyLlama for a 7B model)
+    The small model greedily proposes the next num_pred_tokens tokens. llama.cpp
+    evaluates them together with the next token in one batch and keeps each only
+    while the target model's own sampler picks the same token, so replies are
+    sampled from the target model exactly as without a draft.
+    When the two models have different vocabularies the context and the draft
+    are converted through text.
+    """
+    
+    def __init__(self, model_path, num_pred_tokens=6, n_ctx=2048, **llama_options):
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, verbose=False, **llama_options)
+        self.num_pred_tokens = num_pred_tokens
+        self.target = None
+        self.shared_vocab = False
+        self._pending = None  # (context, draft) not yet checked against the target's output
+    
+    def set_target(self, target):
+        """The Llama the drafts are for; needed to translate tokens between the vocabularies"""
+        self.target = target
+        self.shared_vocab = self._same_vocab(target, self.llm)
+        print(f"Draft model {'shares' if self.shared_vocab else 'does not share'} the vocabulary of the target model")
+    
+    def __call__(self, input_ids, /, **kwargs):
+        self._count_accepted(input_ids)
+        if self.shared_vocab:
+            draft = self._generate(input_ids.tolist())
+        else:
+            draft = self._translated_draft(input_ids)
+        draft = np.array(draft, dtype=np.intc)
+        self._pending = (input_ids.copy(), draft)
+        return draft
+    
+    def _generate(self, tokens):
+        """Up to num_pred_tokens greedy tokens of the draft model"""
+        if len(tokens) + self.num_pred_tokens > self.llm.n_ctx():
+            return []
+        draft = []
+        for token in self.llm.generate(tokens, temp=0.0, top_k=1):
+            if token == self.llm.token_eos():
+                break
+            draft.append(token)
+            if len(draft) == self.num_pred_tokens:
+                break
+        return draft
+    
+    def _translated_draft(self, input_ids):
+        """Draft for target tokens when the models' vocabularies differ"""
+        ids = input_ids.tolist()
+        add_bos = len(ids) > 0 and ids[0] == self.target.token_bos()
+        if add_bos:
+            ids = ids[1:]
+        text = self.target.detokenize(ids, special=True)
+        draft = self._generate(self.llm.tokenize(text, add_bos=add_bos, special=True))
+        if not draft:
+            return []
+        
+        # The first draft token may continue a word the context ends in, so the
+        # draft text is tokenized together with the end of the context
+        tail = self.target.detokenize(ids[-TAIL_TOKENS:], prev_tokens=ids[:-TAIL_TOKENS], special=True)
+        tail_tokens = self.target.tokenize(tail, add_bos=False, special=True)
+        tokens = self.target.tokenize(tail + self.llm.detokenize(draft), add_bos=False, special=True)
+        if common_prefix_length(tail_tokens, tokens) < len(tail_tokens):
+            return []
+        return tokens[len(tail_tokens):][:self.num_pred_tokens]
+    
+    def _count_accepted(self, input_ids):
+        """
+        Acceptance of the previous draft
+        The next call's context is the previous context, the accepted draft
+        tokens and one token the target sampled itself. The last draft of a
+        generation is never checked and not counted.
+        """
+        if self._pending is None:
+            return
+        context, draft = self._pending
+        self._pending = None
+        n = len(context)
+        if len(draft) == 0 or len(input_ids) <= n or common_prefix_length(context, input_ids[:n]) < n:
+            return
+        accepted = common_prefix_length(draft, input_ids[n:-1])
+        DRAFT_TOKENS.inc(accepted, result="accepted")
+        DRAFT_TOKENS.inc(len(draft) - accepted, result="rejected")
+    
+    @staticmethod
+    def _same_vocab(a, b):
+        if a.n_vocab() != b.n_vocab():
+            return False
+        return all(
+            a.detokenize([token], special=True) == b.detokenize([token], special=True)
+            for token in range(0, a.n_vocab(), 97)
+        )
@@ -1,5 +1,6 @@
 // src/components/ChatPage.jsx
 import React, { useState } from "react";
+import { randomId } from "../services/api";
 
 const ChatPage = () => {
   const [chatMessages, setChatMessages] = useState([
@@ -8,19 +9,34 @@ const ChatPage = () => {
   const [inputMessage, setInputMessage] = useState("");
   const [isLoading, setIsLoading] = useState(false);
   const [sentimentInfo, setSentimentInfo] = useState(null);
+  // The backend keeps the conversation history for this id
+  const [sessionId] = useState(randomId);
 
   // API call function
-  const sendMessageToAPI = async (message, conversationHistory) => {
+  const sendMessageToAPI = async (message) => {
     const API_BASE_URL = "http://localhost:5001";
-    const response = await fetch(`${API_BASE_URL}/api/chat`, {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({
-        message,
-        conversation_history: conversationHistory,
-        session_id: "default",
-      }),
-    });
+    // One key per message: a retry of it gets the original reply instead of a second one
+    const idempotencyKey = randomId();
+    const post = () =>
+      fetch(`${API_BASE_URL}/api/chat`, {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+          "Idempotency-Key": idempotencyKey,
+        },
+        body: JSON.stringify({
+          message,
+          session_id: sessionId,
+        }),
+      });
+
+    let response;
+    try {
+      response = await post();
+    } catch (error) {
+      // Network error: the request may have reached the backend, retry once with the same key
+      response = await post();
+    }
 
     if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
     return await response.json();
@@ -35,7 +51,7 @@ const ChatPage = () => {
       setIsLoading(true);
 
       try {
-        const response = await sendMessageToAPI(userMsg, chatMessages);
+        const response = await sendMessageToAPI(userMsg);
 
         setChatMessages([
           ...newMessages,
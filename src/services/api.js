@@ -1,20 +1,27 @@
 const API_BASE_URL = 'http://localhost:5000';
 
+// Random id for sessions and idempotency keys; crypto.randomUUID only exists in secure contexts
+export const randomId = () =>
+  (globalThis.crypto?.randomUUID?.() ?? `${Date.now()}-${Math.random().toString(36).slice(2)}`);
+
 export const chatAPI = {
   /**
    * Send a message to the backend and get AI response
+   * The backend keeps the conversation history per sessionId; without one
+   * the message is answered without any history
+   * A retried request with the same idempotencyKey gets the original reply
    */
-  sendMessage: async (message, conversationHistory = []) => {
+  sendMessage: async (message, sessionId, idempotencyKey = randomId()) => {
     try {
       const response = await fetch(`${API_BASE_URL}/api/chat`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Idempotency-Key': idempotencyKey,
         },
         body: JSON.stringify({
           message,
-          conversation_history: conversationHistory,
-          session_id: 'default'
+          session_id: sessionId
         }),
       });
 
@@ -55,6 +62,27 @@ export const chatAPI = {
     }
   },
 
+  /**
+   * Rolling mood stats (mean compound, tone counts, trend) of a session,
+   * or over all sessions without sessionId
+   */
+  getSentimentSummary: async (sessionId) => {
+    try {
+      const query = sessionId ? `?session_id=${encodeURIComponent(sessionId)}` : '';
+      const response = await fetch(`${API_BASE_URL}/api/sentiment/summary${query}`);
+
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+
+      const data = await response.json();
+      return data;
+    } catch (error) {
+      console.error('Error fetching sentiment summary:', error);
+      throw error;
+    }
+  },
+
   /**
    * Check if backend is running
    */